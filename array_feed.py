@@ -0,0 +1,144 @@
+"""由NumPy数组整列装载的数据源
+
+PandasData逐行装载：每根bar走一遍load()，用iloc逐个单元格取值再写进数据线，
+几百万根分钟bar在第一次next()之前就要装载很久。ArrayData在开始时把各列取成连续的float64数组
+(DataFrame的float64列不复制)，时间索引整列换算成backtrader的日期数值，
+预加载时每条数据线一次frombytes写入行缓冲，不再有逐行的Python循环。
+
+以下情况回到逐行装载(与PandasData的处理一致)：数据源加了过滤器(重采样、回放等)、设置了tzinput、
+cerebro以exactbars限制了缓冲长度，或者不预加载(preload=False)。
+
+时间按墙钟时间换算，不做时区转换，与PandasData对无时区索引的处理相同。
+benchmark()比较同样数据下ArrayData与PandasData的装载耗时。
+"""
+import time
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+_US_PER_DAY = 86400 * 1000000
+# 0001-01-01为第1天，1970-01-01的序数
+_EPOCH_ORDINAL = 719163
+
+
+def date2num(times):
+    """把datetime64数组或epoch秒数组换算成backtrader的日期数值，与bt.date2num逐位一致"""
+    times = np.asarray(times)
+    if times.dtype.kind == 'M':
+        us = times.astype('datetime64[us]').astype(np.int64)
+    else:
+        us = np.round(times.astype(np.float64) * 1e6).astype(np.int64)
+    days, rem = np.divmod(us, _US_PER_DAY)
+    hours, rem = np.divmod(rem, 3600 * 1000000)
+    minutes, rem = np.divmod(rem, 60 * 1000000)
+    seconds, micros = np.divmod(rem, 1000000)
+    # 与bt.date2num相同的运算顺序
+    return (days + _EPOCH_ORDINAL).astype(np.float64) + (hours / 24.0 + minutes / 1440.0
+                                                         + seconds / 86400.0 + micros / 86400000000.0)
+
+
+class ArrayData(bt.feeds.DataBase):
+    """预加载时整列写入行缓冲的数据源
+
+    dataname为DataFrame(时间索引，列名与数据线同名)，或{数据线名: 数组}的字典，
+    字典中时间放在'datetime'，为datetime64或epoch秒。columns把数据线映射到别的列名，
+    如{'volume': 'vol'}。缺少的数据线(如openinterest)为NaN，子类用lines增加的数据线按同样的规则取列。
+    """
+
+    params = (('columns', None),)
+
+    def start(self):
+        super().start()
+        self._arrays = self._collect()
+        self._row = -1
+
+    def _collect(self):
+        data = self.p.dataname
+        columns = self.p.columns or {}
+        if isinstance(data, pd.DataFrame):
+            times = data.index.values
+            names = data.columns
+        else:
+            times = data['datetime']
+            names = data.keys()
+        arrays = {'datetime': date2num(times)}
+        for line in self.getlinealiases():
+            if line == 'datetime':
+                continue
+            name = columns.get(line, line)
+            if name in names:
+                values = data[name].to_numpy(dtype=np.float64) if isinstance(data, pd.DataFrame) \
+                    else np.asarray(data[name], dtype=np.float64)
+                arrays[line] = np.ascontiguousarray(values)
+            else:
+                arrays[line] = np.full(len(times), np.nan)
+        return arrays
+
+    def _load(self):
+        self._row += 1
+        if self._row >= len(self._arrays['datetime']):
+            return False
+        for line, values in self._arrays.items():
+            getattr(self.lines, line)[0] = values[self._row]
+        return True
+
+    def preload(self):
+        if self._filters or self._ffilters or self._tzinput \
+                or any(line.mode == line.QBuffer for line in self.lines):
+            return super().preload()
+        nums = self._arrays['datetime']
+        keep = (nums >= self.fromdate) & (nums <= self.todate)
+        for name, values in self._arrays.items():
+            if not keep.all():
+                values = np.ascontiguousarray(values[keep])
+            # frombytes只接受字节格式的缓冲区，按字节视图传入，不复制
+            getattr(self.lines, name).array.frombytes(memoryview(values).cast('B'))
+        # 全部行已装载，之后next()再调用_load时返回False
+        self._row = len(nums)
+        self.home()
+
+
+def _synthetic_frame(bars, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.002, bars)))
+    open_ = np.r_[close[0], close[:-1]]
+    return pd.DataFrame({
+        'open': open_,
+        'high': np.maximum(open_, close) * 1.001,
+        'low': np.minimum(open_, close) * 0.999,
+        'close': close,
+        'volume': rng.lognormal(10, 1, bars),
+    }, index=pd.date_range('2015-01-05 09:31', periods=bars, freq='min'))
+
+
+def _load_time(feed):
+    """数据源开始(取列、换算时间)和预加载的耗时"""
+    cerebro = bt.Cerebro()
+    cerebro.adddata(feed)
+    start = time.perf_counter()
+    feed._start()
+    feed.preload()
+    return time.perf_counter() - start
+
+
+def benchmark(sizes=(100_000, 1_000_000)):
+    """同样的分钟数据分别用PandasData和ArrayData预加载，打印耗时并核对数据线是否一致"""
+    print(f"{'bar数':>10s} {'PandasData(s)':>14s} {'ArrayData(s)':>13s} {'加速':>7s}  一致")
+    results = []
+    for n in sizes:
+        df = _synthetic_frame(n)
+        pandas_feed = bt.feeds.PandasData(dataname=df)
+        array_feed = ArrayData(dataname=df)
+        t_pandas = _load_time(pandas_feed)
+        t_array = _load_time(array_feed)
+        same = all(np.array_equal(np.asarray(getattr(pandas_feed.lines, c).array),
+                                  np.asarray(getattr(array_feed.lines, c).array))
+                   for c in ('datetime', 'open', 'high', 'low', 'close', 'volume'))
+        print(f"{n:10d} {t_pandas:14.2f} {t_array:13.3f} {t_pandas / t_array:6.0f}x  {same}")
+        results.append({'bars': n, 'pandas_s': t_pandas, 'array_s': t_array, 'identical': same})
+    return results
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,194 @@
+"""回测和实盘状态的检查点
+
+长时间的分钟级回测中途崩溃后不必从头再跑，实盘重启也不必重新回放历史。
+Checkpointer分析器每隔every根bar把以下状态写入磁盘:
+- 每个数据源最近lookback根bar，恢复时放在剩余数据前面重新填满指标窗口；
+- 策略的checkpoint_attrs(如stop_price)和未成交订单；
+- 券商的现金、持仓和未平仓交易。
+
+恢复时resume_data把快照里的bar接上快照之后的新数据，CheckpointMixin在这些bar上只计算指标、
+不产生信号，到快照所在的bar恢复策略属性并重新提交未成交订单，之后与不中断的回测一致。
+指标必须只依赖有限窗口(SMA、CCI、布林带等)，lookback要覆盖最长的窗口。
+预热bar上策略的next不执行，依赖全部历史的状态(风险引擎的滚动协方差、在线学习器)不能靠预热重建，
+要放进Checkpointer的extra随快照保存，恢复时沿用快照里的对象。
+恢复后的净值记录包含这段预热bar。
+
+存储用pickle并原子替换，写到一半崩溃不会破坏上一个检查点。
+"""
+import os
+import pickle
+import tempfile
+
+import backtrader as bt
+import pandas as pd
+
+CHECKPOINT_DIR = os.path.join('data', 'checkpoints')
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+# 快照中保留的最少bar数
+LOOKBACK = 200
+
+
+def save(state, path):
+    """原子写入检查点"""
+    write(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), path)
+
+
+def write(data, path):
+    """把已序列化的检查点原子写入path，每次用独立的临时文件，可以在线程中执行"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def load(path):
+    """读取检查点，不存在时返回None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def resume_data(state, name, df):
+    """快照中name的最近bar接上df里快照之后的bar，作为恢复运行的数据源"""
+    bars = state['bars'][name]
+    rest = df.loc[df.index > bars.index[-1], COLUMNS]
+    return pd.concat([bars, rest])
+
+
+def _recent_bars(data, n):
+    n = min(n, len(data))
+    index = pd.DatetimeIndex([bt.num2date(x) for x in data.datetime.get(size=n)], name='datetime')
+    return pd.DataFrame({c: list(getattr(data, c).get(size=n)) for c in COLUMNS}, index=index)
+
+
+def snapshot(strategy, lookback=LOOKBACK, extra=None):
+    """当前bar处理完之后的策略和券商状态"""
+    names = [d._name for d in strategy.datas]
+    if not all(names) or len(set(names)) != len(names):
+        raise ValueError("检查点需要每个数据源设置唯一的name")
+    broker = strategy.broker
+    positions = {}
+    trades = {}
+    for data in strategy.datas:
+        pos = broker.getposition(data)
+        if pos.size:
+            positions[data._name] = (pos.size, pos.price)
+        open_trades = [t for t in strategy._trades[data][0] if t.isopen]
+        if open_trades:
+            t = open_trades[-1]
+            trades[data._name] = {'size': t.size, 'price': t.price, 'commission': t.commission,
+                                  'dtopen': t.dtopen}
+    return {
+        'ts': strategy.data.datetime.datetime(0),
+        'bars': {d._name: _recent_bars(d, lookback) for d in strategy.datas},
+        'cash': broker.getcash(),
+        'positions': positions,
+        'trades': trades,
+        'strategy': strategy.get_state(),
+        'extra': extra or {},
+    }
+
+
+class CheckpointMixin:
+    """策略的状态快照和恢复，放在策略基类之前混入
+
+    checkpoint_attrs列出需要保存的策略属性，未成交订单从self.order读取。
+    """
+
+    checkpoint_attrs = ('stop_price',)
+    _resume = None
+
+    def get_state(self):
+        order = None
+        if self.order is not None and self.order.alive():
+            order = {
+                'data': self.order.data._name,
+                'isbuy': self.order.isbuy(),
+                'size': abs(self.order.created.size),
+                'exectype': self.order.exectype,
+                'price': self.order.created.price,
+            }
+        return {'attrs': {a: getattr(self, a) for a in self.checkpoint_attrs}, 'order': order}
+
+    def resume_from(self, state):
+        """回测开始前恢复券商状态，策略属性和订单到快照所在的bar再恢复"""
+        broker = self.broker
+        broker.set_cash(state['cash'])
+        for name, (size, price) in state['positions'].items():
+            broker.positions[self.getdatabyname(name)] = bt.Position(size, price)
+        for name, t in state['trades'].items():
+            data = self.getdatabyname(name)
+            trade = bt.Trade(data=data, tradeid=0)
+            trade.size, trade.price = t['size'], t['price']
+            trade.commission, trade.dtopen = t['commission'], t['dtopen']
+            trade.long = trade.size > 0
+            trade.isopen = True
+            trade.status = trade.Open
+            self._trades[data][0].append(trade)
+        self._resume = state
+
+    def _restore(self, state):
+        for a, v in state['attrs'].items():
+            setattr(self, a, v)
+        order = state['order']
+        if order is not None:
+            submit = self.buy if order['isbuy'] else self.sell
+            self.order = submit(data=self.getdatabyname(order['data']), size=order['size'],
+                                exectype=order['exectype'], price=order['price'])
+
+    def next(self):
+        if self._resume is not None:
+            # 快照之前的bar只用于填充指标窗口
+            if self.data.datetime.datetime(0) < self._resume['ts']:
+                return
+            # 快照所在的bar在中断前已经处理过，只恢复状态
+            state, self._resume = self._resume, None
+            self._restore(state['strategy'])
+            return
+        super().next()
+
+
+class Checkpointer(bt.Analyzer):
+    """每every根bar和回测结束时把状态写入path，resume为load()得到的快照时从快照恢复
+
+    extra中的内容(如模型)随快照一起保存。
+    """
+
+    params = (
+        ('path', None),
+        ('every', 1000),
+        ('lookback', LOOKBACK),
+        ('resume', None),
+        ('extra', None),
+    )
+
+    def start(self):
+        self._bars = 0
+        self.lookback = max(self.p.lookback, 2 * max(self.strategy._minperiods))
+        if self.p.resume is not None:
+            self.strategy.resume_from(self.p.resume)
+
+    def next(self):
+        self._bars += 1
+        if self.p.every and self._bars % self.p.every == 0:
+            self.save()
+
+    def stop(self):
+        self.save()
+
+    def save(self):
+        # 恢复运行还没到快照所在的bar时策略状态不完整，不覆盖原来的检查点
+        if self.p.path and self._bars and self.strategy._resume is None:
+            save(snapshot(self.strategy, self.lookback, self.p.extra), self.p.path)
+
+
+def with_checkpoint(strategy_cls):
+    """混入CheckpointMixin的策略子类，next在MRO中排在策略自己的next之前"""
+    return type(strategy_cls.__name__, (CheckpointMixin, strategy_cls), {})
@@ -0,0 +1,427 @@
+"""多机分布式回测：基于任务队列的协调器/工作节点
+
+协调器把(标的, 参数, 时间窗口)拆成独立任务放进任务队列，各节点上的工作进程
+主动领取任务，从共享存储读取bar数据和模型，回测后把绩效指标送回协调器。
+任务队列由协调器进程内的JobBroker充当，通过multiprocessing.managers在网络上暴露，
+不需要额外部署消息中间件；换成Redis等外部队列时只需实现同样的lease/complete/fail接口。
+
+manager之间传递的是pickle数据，知道认证密钥就能在协调器和所有工作进程上执行任意代码。
+密钥取自环境变量QT_CLUSTER_AUTHKEY，协调器启动时未设置则随机生成并打印，工作进程必须设置；
+协调器默认只监听127.0.0.1，多机部署时须显式指定监听地址(如0.0.0.0)，并只在可信网络内开放端口。
+
+工作进程领取任务时获得一个租约，执行期间定时续约；租约到期仍未交回结果
+(节点宕机、进程被杀)的任务重新入队，超过最大尝试次数记为失败。
+任务完成或失败后不再改变，重复执行交回的结果会被忽略。
+
+用法::
+
+    # 共享存储(NFS等)上准备bar数据和模型，然后启动协调器，监听所有网卡须显式指定
+    export QT_CLUSTER_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(16))")
+    python cluster.py coordinator 0.0.0.0
+    # 每个节点上用同一个密钥启动若干工作进程
+    QT_CLUSTER_AUTHKEY=... python cluster.py worker 10.0.0.1:50000
+    # 单机演示：协调器和n个工作进程
+    python cluster.py local 4
+"""
+import itertools
+import os
+import pickle
+import secrets
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from multiprocessing.managers import BaseManager
+
+# 默认只监听本机，监听其他网卡须显式指定
+HOST = '127.0.0.1'
+PORT = 50000
+STORAGE = os.environ.get('QT_CLUSTER_STORAGE', os.path.join('data', 'cluster'))
+# 租约时间(秒)：工作进程每隔1/3租约时间续约一次，超时说明工作进程已经失联
+LEASE_TIMEOUT = 60
+MAX_ATTEMPTS = 3
+
+
+# ---- 共享存储 ----
+
+def write_bars(storage, symbol, df):
+    """把一个标的的OHLCV数据写入共享存储"""
+    path = os.path.join(storage, 'bars')
+    os.makedirs(path, exist_ok=True)
+    df[['open', 'high', 'low', 'close', 'volume']].to_pickle(os.path.join(path, f'{symbol}.pkl'))
+
+
+def read_bars(storage, symbol, start, end):
+    """读取一个标的在[start, end]内的bar，含end当天全天(与strategy.prepare_data口径相同)"""
+    import pandas as pd
+    from strategy import select_dates
+    return select_dates(pd.read_pickle(os.path.join(storage, 'bars', f'{symbol}.pkl')), start, end)
+
+
+def publish_models(storage, rf_model, xgb_model):
+    os.makedirs(storage, exist_ok=True)
+    tmp = os.path.join(storage, 'models.pkl.tmp')
+    with open(tmp, 'wb') as f:
+        pickle.dump((rf_model, xgb_model), f)
+    # 先写临时文件再改名，工作进程不会读到写了一半的模型
+    os.replace(tmp, os.path.join(storage, 'models.pkl'))
+
+
+_models = {}
+
+
+def load_models(storage):
+    """按文件修改时间缓存模型，同一工作进程只在模型更新后重新加载
+
+    返回(随机森林, XGBoost, 预测缓存)，预测缓存也放在共享存储上，
+    只改规则参数的任务之间共用推理结果。
+    """
+    from pred_cache import PredictionCache
+
+    path = os.path.join(storage, 'models.pkl')
+    mtime = os.path.getmtime(path)
+    if _models.get('mtime') != mtime:
+        with open(path, 'rb') as f:
+            rf_model, xgb_model = pickle.load(f)
+        cache = PredictionCache.for_models(rf_model, xgb_model, os.path.join(storage, 'pred_cache'))
+        _models['models'] = rf_model, xgb_model, cache
+        _models['mtime'] = mtime
+    return _models['models']
+
+
+def stage_data(storage, codes, start_date, end_date):
+    """协调器端：获取各标的分钟数据写入共享存储，返回成功的标的"""
+    from strategy import prepare_data
+    staged = []
+    for code in codes:
+        df = prepare_data(code, start_date, end_date)
+        if not df.empty:
+            write_bars(storage, code, df)
+            staged.append(code)
+    return staged
+
+
+# ---- 任务 ----
+
+def make_jobs(symbols, param_grid, windows):
+    """展开(标的, 参数, 窗口)的全部组合，param_grid为{参数名: 候选值列表}"""
+    keys = list(param_grid)
+    params_list = [dict(zip(keys, values)) for values in itertools.product(*param_grid.values())]
+    return [{'id': i, 'symbol': symbol, 'params': params, 'window': tuple(window)}
+            for i, (symbol, params, window) in enumerate(itertools.product(symbols, params_list, windows))]
+
+
+def run_job(job, storage):
+    """工作进程端：读取bar和模型，回测一个任务，返回可序列化的结果"""
+    import strategy
+
+    start = time.perf_counter()
+    df = read_bars(storage, job['symbol'], *job['window'])
+    if df.empty:
+        raise ValueError(f"{job['symbol']} 在 {job['window']} 内没有数据")
+    rf_model, xgb_model, cache = load_models(storage)
+    strat, metrics = strategy.run_backtest([df], rf_model, xgb_model, names=[job['symbol']],
+                                           pred_cache=cache, **job['params'])
+    return {
+        'final_value': strat.broker.getvalue(),
+        **{k: float(v) for k, v in metrics.items()},
+        'bars': len(df),
+        'elapsed': time.perf_counter() - start,
+    }
+
+
+# ---- 任务队列 ----
+
+class JobBroker:
+    """协调器进程内的任务队列，方法经由manager被各节点远程调用"""
+
+    def __init__(self, lease_timeout=LEASE_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._pending = deque()
+        self._attempts = defaultdict(int)
+        self._leases = {}
+        self._results = {}
+        self._failed = {}
+        self._workers = defaultdict(lambda: {'jobs': 0, 'bars': 0, 'busy': 0.0, 'errors': 0})
+        self._retries = 0
+        self._closed = False
+
+    def put(self, jobs):
+        with self._lock:
+            for job in jobs:
+                self._jobs[job['id']] = job
+                self._pending.append(job['id'])
+
+    def _requeue_or_fail(self, job_id, error):
+        if self._attempts[job_id] >= self.max_attempts:
+            self._failed[job_id] = error
+        else:
+            self._retries += 1
+            self._pending.append(job_id)
+
+    def _reap(self):
+        now = time.time()
+        for job_id, (worker, deadline) in list(self._leases.items()):
+            if deadline < now:
+                del self._leases[job_id]
+                self._requeue_or_fail(job_id, f'租约超时(最后由 {worker} 领取)')
+
+    def lease(self, worker):
+        """领取一个任务，没有可领取的任务时返回None"""
+        with self._lock:
+            self._reap()
+            while self._pending:
+                job_id = self._pending.popleft()
+                if job_id in self._results or job_id in self._failed:
+                    continue
+                self._attempts[job_id] += 1
+                self._leases[job_id] = (worker, time.time() + self.lease_timeout)
+                return self._jobs[job_id]
+            return None
+
+    def renew(self, job_id, worker):
+        """续约，租约已过期或已转给其他工作进程时返回False"""
+        with self._lock:
+            lease = self._leases.get(job_id)
+            if lease is None or lease[0] != worker:
+                return False
+            self._leases[job_id] = (worker, time.time() + self.lease_timeout)
+            return True
+
+    def complete(self, job_id, worker, result):
+        """提交结果，任务已完成或已判定失败时忽略"""
+        with self._lock:
+            if self._leases.get(job_id, (None,))[0] == worker:
+                del self._leases[job_id]
+            if job_id in self._results or job_id in self._failed:
+                return False
+            self._results[job_id] = {**result, 'worker': worker, 'attempts': self._attempts[job_id]}
+            stats = self._workers[worker]
+            stats['jobs'] += 1
+            stats['bars'] += result.get('bars', 0)
+            stats['busy'] += result.get('elapsed', 0.0)
+            return True
+
+    def fail(self, job_id, worker, error):
+        with self._lock:
+            self._workers[worker]['errors'] += 1
+            if self._leases.get(job_id, (None,))[0] == worker:
+                del self._leases[job_id]
+                self._requeue_or_fail(job_id, error)
+
+    def get_lease_timeout(self):
+        return self.lease_timeout
+
+    def finished(self):
+        with self._lock:
+            self._reap()
+            return len(self._results) + len(self._failed) >= len(self._jobs)
+
+    def close(self):
+        """通知工作进程没有新任务了"""
+        with self._lock:
+            self._closed = True
+
+    def closed(self):
+        return self._closed
+
+    def status(self):
+        with self._lock:
+            self._reap()
+            return {'jobs': len(self._jobs), 'pending': len(self._pending), 'running': len(self._leases),
+                    'done': len(self._results), 'failed': len(self._failed), 'retries': self._retries}
+
+    def snapshot(self):
+        with self._lock:
+            return (dict(self._results), dict(self._failed),
+                    {w: dict(s) for w, s in self._workers.items()}, self._retries)
+
+
+class _BrokerManager(BaseManager):
+    pass
+
+
+def _parse_address(address):
+    if isinstance(address, str):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+def _env_authkey():
+    key = os.environ.get('QT_CLUSTER_AUTHKEY')
+    return key.encode() if key else None
+
+
+def connect(address, authkey=None):
+    """工作进程端：连接协调器上的任务队列，authkey默认取环境变量QT_CLUSTER_AUTHKEY"""
+    authkey = authkey or _env_authkey()
+    if authkey is None:
+        raise ValueError("需要设置环境变量QT_CLUSTER_AUTHKEY(与协调器相同的认证密钥)")
+    _BrokerManager.register('broker')
+    manager = _BrokerManager(address=_parse_address(address), authkey=authkey)
+    manager.connect()
+    return manager.broker()
+
+
+class Coordinator:
+    """在本进程内运行任务队列并通过网络提供给工作进程
+
+    默认只监听127.0.0.1，其他节点要连接时须显式传入address(如('0.0.0.0', PORT))。
+    authkey默认取环境变量QT_CLUSTER_AUTHKEY，未设置时随机生成并打印，工作进程需设置同一个密钥。
+    """
+
+    def __init__(self, address=(HOST, PORT), authkey=None,
+                 lease_timeout=LEASE_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        authkey = authkey or _env_authkey()
+        if authkey is None:
+            authkey = secrets.token_hex(16).encode()
+            print(f"未设置QT_CLUSTER_AUTHKEY，本次随机生成的认证密钥: {authkey.decode()}")
+        self.authkey = authkey
+        self.broker = JobBroker(lease_timeout, max_attempts)
+        broker = self.broker
+        _BrokerManager.register('broker', callable=lambda: broker)
+        manager = _BrokerManager(address=_parse_address(address), authkey=authkey)
+        self._server = manager.get_server()
+        self.address = self._server.address
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.started = None
+        self.elapsed = None
+
+    def run(self, jobs, poll=1.0, progress_every=10.0):
+        """提交全部任务并等待完成，返回(结果DataFrame, 失败任务)"""
+        import pandas as pd
+
+        self.broker.put(jobs)
+        self.started = time.time()
+        last = 0.0
+        print(f"协调器 {self.address[0]}:{self.address[1]} 已提交 {len(jobs)} 个任务")
+        while not self.broker.finished():
+            time.sleep(poll)
+            if time.time() - last >= progress_every:
+                last = time.time()
+                print("进度:", self.broker.status())
+        self.elapsed = time.time() - self.started
+        self.broker.close()
+
+        results, failed, _, _ = self.broker.snapshot()
+        jobs_by_id = {job['id']: job for job in jobs}
+        rows = []
+        for job_id, result in sorted(results.items()):
+            job = jobs_by_id[job_id]
+            rows.append({'id': job_id, 'symbol': job['symbol'], 'start': job['window'][0],
+                         'end': job['window'][1], **job['params'], **result})
+        return pd.DataFrame(rows), {job_id: (jobs_by_id[job_id], err) for job_id, err in failed.items()}
+
+    def throughput_report(self):
+        import pandas as pd
+
+        results, failed, workers, retries = self.broker.snapshot()
+        bars = sum(r['bars'] for r in results.values())
+        elapsed = self.elapsed or (time.time() - self.started)
+        print(f"完成 {len(results)} 个任务，失败 {len(failed)} 个，重试 {retries} 次，"
+              f"耗时 {elapsed:.1f}s，{len(results) / elapsed:.2f} 任务/s，{bars / elapsed:,.0f} bar/s")
+        report = pd.DataFrame.from_dict(workers, orient='index')
+        if not report.empty:
+            report['bars_per_s'] = report['bars'] / report['busy'].where(report['busy'] > 0)
+        return report
+
+
+def _heartbeat(address, authkey, worker_id, current, stop, interval):
+    """续约线程，使用独立连接(manager代理不能跨线程共用)"""
+    try:
+        broker = connect(address, authkey)
+        while not stop.wait(interval):
+            job_id = current.get('id')
+            if job_id is not None:
+                broker.renew(job_id, worker_id)
+    except (EOFError, ConnectionError):
+        pass
+
+
+def run_worker(address, authkey=None, storage=STORAGE, worker_id=None, poll=1.0):
+    """工作进程主循环：领取任务、执行、交回结果，协调器关闭或断开时退出"""
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    broker = connect(address, authkey)
+    current = {}
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, daemon=True,
+                     args=(address, authkey, worker_id, current, stop,
+                           broker.get_lease_timeout() / 3)).start()
+    done = 0
+    try:
+        while True:
+            job = broker.lease(worker_id)
+            if job is None:
+                if broker.closed():
+                    break
+                time.sleep(poll)
+                continue
+            current['id'] = job['id']
+            try:
+                result = run_job(job, storage)
+            except Exception as e:
+                print(f"[{worker_id}] 任务 {job['id']} 失败:", e)
+                broker.fail(job['id'], worker_id, f'{type(e).__name__}: {e}')
+                continue
+            finally:
+                current['id'] = None
+            broker.complete(job['id'], worker_id, result)
+            done += 1
+    except (EOFError, ConnectionError):
+        print(f"[{worker_id}] 与协调器的连接已断开")
+    finally:
+        stop.set()
+    print(f"[{worker_id}] 退出，共完成 {done} 个任务")
+
+
+# 演示用的任务规模：全市场时替换为股票池
+DEFAULT_CODES = ['000001.SZ', '600000.SH']
+DEFAULT_GRID = {'volume_ratio': [1.2, 1.5, 2.0], 'stop_loss': [0.03, 0.05], 'entry_prob': [0.6, 0.7]}
+DEFAULT_TRAIN = ('20230801', '20230815')
+DEFAULT_WINDOWS = [('20230816', '20230823'), ('20230824', '20230831')]
+
+
+def prepare_storage(storage=STORAGE, codes=DEFAULT_CODES, train=DEFAULT_TRAIN, windows=DEFAULT_WINDOWS):
+    """准备共享存储：训练模型并发布，写入回测期的bar数据"""
+    import pandas as pd
+    from strategy import prepare_data, train_models
+
+    train_dfs = [df for df in (prepare_data(code, *train) for code in codes) if not df.empty]
+    if not train_dfs:
+        raise ValueError("No valid data available for any of the provided codes")
+    publish_models(storage, *train_models(pd.concat(train_dfs)))
+    return stage_data(storage, codes, min(w[0] for w in windows), max(w[1] for w in windows))
+
+
+if __name__ == '__main__':
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'local'
+    if mode == 'worker':
+        run_worker(sys.argv[2])
+    else:
+        codes = prepare_storage()
+        workers = []
+        if mode == 'coordinator':
+            # 可选参数为监听地址，如0.0.0.0或0.0.0.0:50000
+            address = sys.argv[2] if len(sys.argv) > 2 else (HOST, PORT)
+            if isinstance(address, str) and ':' not in address:
+                address = (address, PORT)
+            coordinator = Coordinator(address)
+        else:
+            import multiprocessing
+            coordinator = Coordinator()
+            address = ('127.0.0.1', coordinator.address[1])
+            n = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+            workers = [multiprocessing.Process(target=run_worker, args=(address, coordinator.authkey))
+                       for _ in range(n)]
+            for p in workers:
+                p.start()
+        results, failed = coordinator.run(make_jobs(codes, DEFAULT_GRID, DEFAULT_WINDOWS))
+        print(results.sort_values('sharpe', ascending=False).to_string())
+        print(coordinator.throughput_report())
+        for p in workers:
+            p.join()
@@ -0,0 +1,274 @@
+"""常驻任务进程
+
+脚本每次启动都要导入backtrader/akshare/sklearn/xgboost，退出时行情、特征和模型全部丢弃。
+daemon.py serve 启动一个常驻进程，启动时预先导入重模块，之后在本机端口上接收
+screen/backtest/predict任务，行情、特征和训练好的模型都缓存在进程内，
+重复任务只付计算本身的开销。
+
+协议：每个连接发送一行JSON {"job": 名称, "args": {...}}，返回一行JSON
+{"ok": true, "result": ..., "elapsed": 秒} 或 {"ok": false, "error": ...}。
+
+用法::
+
+    python daemon.py serve
+    python daemon.py screen '{"symbols": ["510300", "159920"]}'
+    python daemon.py backtest '{"codes": ["000001.SZ"], "train_start": "20230801", ...}'
+    python daemon.py stats
+
+客户端只依赖标准库，启动是毫秒级的。
+"""
+import json
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+HOST = '127.0.0.1'
+PORT = 8765
+# 日线历史用于盘中筛选，缓存过期时间较短；分钟特征和模型按参数永久缓存
+HISTORY_TTL = 60
+# 截止日期为今天或以后的分钟特征和模型，数据还在增长，与日线历史一样定期刷新
+OPEN_WINDOW_TTL = 60
+
+
+class Cache:
+    """带过期时间的进程内缓存，同一个key同时只计算一次"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._items = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute, ttl=None, keep=None):
+        """ttl覆盖这一项的过期时间；keep(value)为假时结果不缓存，下次重新计算"""
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            item = self._items.get(key)
+            if item is not None and (item[0] is None or time.time() < item[0]):
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+            value = compute()
+            if keep is None or keep(value):
+                self._items[key] = (None if ttl is None else time.time() + ttl, value)
+            else:
+                self._items.pop(key, None)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class Workspace:
+    """常驻进程中的数据、特征和模型"""
+
+    def __init__(self):
+        self.history = Cache(ttl=HISTORY_TTL)
+        self.minutes = Cache()
+        self.models = Cache()
+        self.caches = Cache()
+        self.started = time.time()
+
+    def preload(self):
+        """预先导入任务用到的重模块，第一个任务也不必等待导入"""
+        start = time.perf_counter()
+        import akshare  # noqa: F401
+        import backtrader  # noqa: F401
+        import sklearn.ensemble  # noqa: F401
+        import xgboost  # noqa: F401
+        import screener  # noqa: F401
+        import strategy  # noqa: F401
+        print(f"模块预加载完成，耗时 {time.perf_counter() - start:.2f}s")
+
+    def fetch_history(self, symbol):
+        import screener
+        return self.history.get(symbol, lambda: screener.fetch_history(symbol))
+
+    @staticmethod
+    def window_ttl(end_date):
+        """截止日期未过完的窗口定期过期，已结束的窗口永久缓存"""
+        import pandas as pd
+        if pd.Timestamp(end_date).normalize() >= pd.Timestamp.today().normalize():
+            return OPEN_WINDOW_TTL
+        return None
+
+    def prepare_data(self, code, start_date, end_date):
+        """取数失败时strategy.prepare_data返回空表，空表不缓存，下次重新取数"""
+        import strategy
+        return self.minutes.get((code, start_date, end_date),
+                                lambda: strategy.prepare_data(code, start_date, end_date),
+                                ttl=self.window_ttl(end_date), keep=lambda df: not df.empty)
+
+    def train(self, codes, start_date, end_date):
+        """有标的没取到数据时照常训练但不缓存模型，下次重新取数训练"""
+        import pandas as pd
+        import strategy
+
+        def compute():
+            dfs, missing = [], []
+            for c in codes:
+                df = self.prepare_data(c, start_date, end_date)
+                if df.empty:
+                    missing.append(c)
+                else:
+                    dfs.append(df)
+            if not dfs:
+                raise ValueError("No valid data available for any of the provided codes")
+            if missing:
+                print(f"以下标的没有数据，本次训练未包含: {', '.join(missing)}")
+            return strategy.train_models(pd.concat(dfs)), not missing
+        return self.models.get((tuple(codes), start_date, end_date), compute,
+                               ttl=self.window_ttl(end_date), keep=lambda v: v[1])[0]
+
+    def pred_cache(self, rf_model, xgb_model):
+        """每组模型一个预测缓存，按模型内容的指纹共用，常驻进程内的多次回测共用"""
+        from pred_cache import PredictionCache, model_fingerprint
+        fingerprint = model_fingerprint(rf_model, xgb_model)
+        return self.caches.get(fingerprint, lambda: PredictionCache(fingerprint))
+
+    # ---- 任务 ----
+
+    def job_screen(self, symbols=None, volume_ratio=1.1, **prefilter_kwargs):
+        """筛选ETF，未指定symbols时先取全市场快照做预筛选"""
+        import asyncio
+        import screener
+
+        if symbols is None:
+            import akshare as ak
+            df_spot = ak.stock_zh_a_spot()
+            symbols = screener.prefilter(df_spot, **{**screener.DEFAULT_PREFILTER, **prefilter_kwargs})
+
+        def condition(df):
+            return screener.match_conditions(df, volume_ratio=volume_ratio)
+
+        async def collect():
+            return [s async for s in screener.screen_stream(symbols, fetch=self.fetch_history,
+                                                            condition=condition)]
+        return asyncio.run(collect())
+
+    def job_backtest(self, codes, train_start, train_end, valid_start, valid_end,
+                     cash=1000000.0, talib_lines=False, **strategy_params):
+        """训练(或复用已训练的模型)并回测，返回绩效指标；strategy_params为MLStrategy的规则参数"""
+        import strategy
+
+        rf_model, xgb_model = self.train(codes, train_start, train_end)
+        datas = [self.prepare_data(c, valid_start, valid_end) for c in codes]
+        strat, metrics = strategy.run_backtest(datas, rf_model, xgb_model, cash=cash,
+                                               talib_lines=talib_lines, names=codes,
+                                               pred_cache=self.pred_cache(rf_model, xgb_model),
+                                               **strategy_params)
+        return {'final_value': strat.broker.getvalue(),
+                **{k: float(v) for k, v in metrics.items()}}
+
+    def job_predict(self, codes, train_start, train_end, symbol, start_date, end_date):
+        """用模型给symbol在区间内最后一根完整bar打分，返回两个模型的上涨概率"""
+        import numpy as np
+        import strategy
+
+        rf_model, xgb_model = self.train(codes, train_start, train_end)
+        df = self.prepare_data(symbol, start_date, end_date)
+        X = df[strategy.FEATURES]
+        X = X[np.isfinite(X.to_numpy()).all(axis=1)]
+        if X.empty:
+            raise ValueError(f"{symbol} 在 {start_date}~{end_date} 没有可用的特征")
+        last = X.iloc[[-1]]
+        rf_pred = float(rf_model.predict_proba(last)[0][1])
+        xgb_pred = float(xgb_model.predict_proba(last)[0][1])
+        return {'time': str(last.index[0]), 'rf': rf_pred, 'xgb': xgb_pred,
+                'prob': (rf_pred + xgb_pred) / 2}
+
+    def job_stats(self):
+        import http_pool
+        return {
+            'uptime': time.time() - self.started,
+            'http': http_pool.stats(),
+            **{name: {'items': len(c), 'hits': c.hits, 'misses': c.misses}
+               for name, c in (('history', self.history), ('minutes', self.minutes),
+                               ('models', self.models), ('caches', self.caches))},
+        }
+
+    def job_clear(self):
+        for c in (self.history, self.minutes, self.models, self.caches):
+            c.clear()
+        return True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.readline())
+            job = request['job']
+            if job == 'shutdown':
+                # shutdown()会等待serve_forever退出，不能在处理线程里同步调用
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                result = True
+            else:
+                handler = getattr(self.server.workspace, 'job_' + job, None)
+                if handler is None:
+                    raise ValueError(f"未知任务: {job}")
+                result = handler(**request.get('args', {}))
+            response = {'ok': True, 'result': result}
+        except Exception as e:
+            response = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+        response['elapsed'] = time.perf_counter() - start
+        self.wfile.write(json.dumps(response, ensure_ascii=False, default=str).encode() + b'\n')
+
+
+class JobServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host=HOST, port=PORT, workspace=None):
+        super().__init__((host, port), _Handler)
+        self.workspace = workspace or Workspace()
+
+
+def serve(host=HOST, port=PORT, preload=True):
+    import http_pool
+    http_pool.install()
+    workspace = Workspace()
+    if preload:
+        workspace.preload()
+    with JobServer(host, port, workspace) as server:
+        print(f"任务进程已启动: {host}:{server.server_address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    print("任务进程已退出")
+
+
+def submit(job, host=HOST, port=PORT, timeout=None, **args):
+    """把任务发给常驻进程并等待结果，任务失败时抛出RuntimeError"""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(json.dumps({'job': job, 'args': args}).encode() + b'\n')
+        with sock.makefile('rb') as f:
+            response = json.loads(f.readline())
+    if not response['ok']:
+        raise RuntimeError(response['error'])
+    return response['result']
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+    elif sys.argv[1] == 'serve':
+        serve()
+    else:
+        start = time.perf_counter()
+        args = json.loads(sys.argv[2]) if len(sys.argv) > 2 else {}
+        print(json.dumps(submit(sys.argv[1], **args), ensure_ascii=False, indent=2))
+        print(f"耗时 {time.perf_counter() - start:.3f}s")
@@ -0,0 +1,152 @@
+import json
+import os
+
+import numpy as np
+import xgboost as xgb
+
+from strategy import FEATURES, LABEL_HORIZON, prepare_data
+
+
+class DatasetBuilder:
+    """把逐个标的的特征/标签块追加写入磁盘，内存中只保留当前标的的数据"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.rows = 0
+        self.symbols = []
+        # 重新构建时覆盖旧文件；旧的meta.json先删除，构建完成前目录不能被当作数据集打开
+        self._meta = os.path.join(path, 'meta.json')
+        if os.path.exists(self._meta):
+            os.remove(self._meta)
+        self._x = open(os.path.join(path, 'X.f32'), 'wb')
+        self._y = open(os.path.join(path, 'y.f32'), 'wb')
+
+    def append(self, code, df):
+        """追加一个标的的特征块，去掉指标预热期和标签未知的最后几根bar"""
+        if len(df) <= LABEL_HORIZON:
+            return 0
+        df = df.iloc[:-LABEL_HORIZON]
+        X = df[FEATURES].to_numpy(dtype=np.float32)
+        y = df['target'].to_numpy(dtype=np.float32)
+        valid = np.isfinite(X).all(axis=1)
+        X, y = X[valid], y[valid]
+        X.tofile(self._x)
+        y.tofile(self._y)
+        self.symbols.append({'code': code, 'start': self.rows, 'end': self.rows + len(y)})
+        self.rows += len(y)
+        return len(y)
+
+    def abort(self):
+        """出错时关闭文件句柄，不写meta.json"""
+        self._x.close()
+        self._y.close()
+
+    def close(self):
+        self.abort()
+        # meta.json原子写入，存在即表示X/y已完整写完
+        tmp = self._meta + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'rows': self.rows, 'features': FEATURES, 'symbols': self.symbols}, f,
+                      ensure_ascii=False, indent=2)
+        os.replace(tmp, self._meta)
+        return MinuteDataset(self.path)
+
+
+class MinuteDataset:
+    """磁盘上的float32特征矩阵和标签向量，以内存映射方式只读打开"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.rows = self.meta['rows']
+        self.features = self.meta['features']
+        shape = (self.rows, len(self.features))
+        if self.rows:
+            self.X = np.memmap(os.path.join(path, 'X.f32'), dtype=np.float32, mode='r', shape=shape)
+            self.y = np.memmap(os.path.join(path, 'y.f32'), dtype=np.float32, mode='r', shape=(self.rows,))
+        else:
+            self.X = np.empty(shape, dtype=np.float32)
+            self.y = np.empty(0, dtype=np.float32)
+
+    def __len__(self):
+        return self.rows
+
+    def sample(self, n, seed=0):
+        """随机抽取n行读入内存(按行号排序以保持顺序读取)"""
+        if n >= self.rows:
+            return np.asarray(self.X), np.asarray(self.y)
+        idx = np.sort(np.random.default_rng(seed).choice(self.rows, size=n, replace=False))
+        return self.X[idx], self.y[idx]
+
+
+def build_dataset(codes, start_date, end_date, path):
+    """逐个标的获取分钟数据并计算特征，流式写入磁盘数据集"""
+    builder = DatasetBuilder(path)
+    try:
+        for code in codes:
+            df = prepare_data(code, start_date, end_date)
+            if df.empty:
+                continue
+            n = builder.append(code, df)
+            print(f'{code} 写入样本 {n} 行，累计 {builder.rows} 行')
+    except BaseException:
+        builder.abort()
+        raise
+    return builder.close()
+
+
+class _BatchIter(xgb.DataIter):
+    """按块把内存映射数据交给XGBoost，配合cache_prefix走外存训练"""
+
+    def __init__(self, dataset, batch_rows, cache_prefix):
+        self._dataset = dataset
+        self._batch_rows = batch_rows
+        self._pos = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._pos >= self._dataset.rows:
+            return 0
+        end = min(self._pos + self._batch_rows, self._dataset.rows)
+        input_data(data=np.asarray(self._dataset.X[self._pos:end]),
+                   label=np.asarray(self._dataset.y[self._pos:end]))
+        self._pos = end
+        return 1
+
+    def reset(self):
+        self._pos = 0
+
+
+class BoosterClassifier:
+    """把原生Booster包装成predict_proba接口，供MLStrategy直接使用"""
+
+    def __init__(self, booster):
+        self.booster = booster
+
+    def predict_proba(self, X):
+        p = self.booster.predict(xgb.DMatrix(np.asarray(X, dtype=np.float32)))
+        return np.column_stack([1 - p, p])
+
+
+def train_xgb_external(dataset, params=None, num_boost_round=100, batch_rows=1_000_000):
+    """以外存模式训练XGBoost，训练过程中只有当前数据块驻留内存"""
+    params = {'objective': 'binary:logistic', 'tree_method': 'hist',
+              'max_depth': 5, 'learning_rate': 0.1, **(params or {})}
+    it = _BatchIter(dataset, batch_rows, cache_prefix=os.path.join(dataset.path, 'xgb_cache'))
+    dtrain = xgb.DMatrix(it)
+    booster = xgb.train(params, dtrain, num_boost_round=num_boost_round)
+    return BoosterClassifier(booster)
+
+
+def train_models_from_dataset(dataset, rf_sample_rows=1_000_000, batch_rows=1_000_000):
+    """从磁盘数据集训练模型：XGBoost使用全量外存数据，随机森林使用有上限的随机抽样"""
+    from sklearn.ensemble import RandomForestClassifier
+
+    X, y = dataset.sample(rf_sample_rows)
+    rf_model = RandomForestClassifier(n_estimators=100, max_depth=5)
+    rf_model.fit(X, y.astype(int))
+
+    xgb_model = train_xgb_external(dataset, batch_rows=batch_rows)
+    return rf_model, xgb_model
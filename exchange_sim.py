@@ -0,0 +1,178 @@
+import queue
+import threading
+import time
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+
+class SimExchange:
+    """进程内模拟交易所
+
+    独立线程撮合：订单到达后等待latency秒(模拟网络和撮合延迟)，
+    再按交易所当时看到的最新bar收盘价成交，成交回报放入回报队列。
+    注意撮合线程与回测共用GIL，回测满速运行时成交延迟会受线程切换间隔(默认5ms)影响。
+    """
+
+    def __init__(self, latency=0.001):
+        self.latency = latency
+        self._inbox = queue.Queue()
+        self._fills = queue.Queue()
+        self._last_price = {}
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._inbox.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def on_bar(self, symbol, price):
+        """回放行情：更新交易所看到的最新价"""
+        self._last_price[symbol] = price
+
+    def send(self, ref, symbol, size):
+        """下单，立即返回，成交通过poll_fills取得"""
+        self._inbox.put((time.perf_counter(), ref, symbol, size))
+
+    def poll_fills(self):
+        """取出目前所有已成交回报 (ref, price, 成交时间)"""
+        fills = []
+        while True:
+            try:
+                fills.append(self._fills.get_nowait())
+            except queue.Empty:
+                return fills
+
+    def _run(self):
+        while True:
+            msg = self._inbox.get()
+            if msg is None:
+                return
+            sent, ref, symbol, size = msg
+            # 延迟固定，到达顺序即成交顺序
+            delay = sent + self.latency - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._fills.put((ref, self._last_price[symbol], time.perf_counter()))
+
+
+class SimExchangeBroker(bt.brokers.BackBroker):
+    """把市价单路由到SimExchange的经纪商
+
+    策略代码无需修改(MultiIndicatorStrategy/MLStrategy直接使用)。
+    bar_rate>0时按每秒bar_rate根的速度回放行情，用于压测；
+    同时记录bar到达->下单、下单->成交两段延迟。
+    """
+
+    params = (
+        ('exchange', None),
+        ('bar_rate', 0),
+    )
+
+    def start(self):
+        super().start()
+        self.exchange = self.p.exchange or SimExchange()
+        self.exchange.start()
+        self._inflight = {}
+        self._symbols = {}
+        self._bar_time = None
+        self._t0 = None
+        self._nbars = 0
+        self.tick_to_order = []
+        self.order_to_fill = []
+
+    def stop(self):
+        self.exchange.stop()
+        self._t1 = time.perf_counter()
+        super().stop()
+
+    def next(self):
+        # 控制行情回放速度
+        if self._t0 is None:
+            self._t0 = time.perf_counter()
+        elif self.p.bar_rate:
+            delay = self._t0 + self._nbars / self.p.bar_rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self._nbars += 1
+
+        for data, symbol in self._symbols.items():
+            self.exchange.on_bar(symbol, data.close[0])
+
+        super().next()
+        self._apply_fills()
+        self._bar_time = time.perf_counter()
+
+    def submit(self, order, check=True):
+        if self._bar_time is not None:
+            order.sim_submitted = time.perf_counter()
+            self.tick_to_order.append(order.sim_submitted - self._bar_time)
+        return super().submit(order, check)
+
+    def submit_accept(self, order):
+        if order.exectype != bt.Order.Market:
+            return super().submit_accept(order)
+        order.pannotated = None
+        order.submit()
+        order.accept()
+        self.notify(order)
+        data = order.data
+        symbol = self._symbols.setdefault(data, data._name or str(id(data)))
+        # 交易所可能还没有看到这个标的的行情
+        self.exchange.on_bar(symbol, data.close[0])
+        self._inflight[order.ref] = order
+        self.exchange.send(order.ref, symbol, order.created.size)
+
+    def _apply_fills(self):
+        for ref, price, filled in self.exchange.poll_fills():
+            order = self._inflight.pop(ref)
+            self._execute(order, ago=0, price=price)
+            if order.alive():
+                # 资金不足无法成交
+                order.margin()
+                self.notify(order)
+            if hasattr(order, 'sim_submitted'):
+                self.order_to_fill.append(filled - order.sim_submitted)
+
+    def latency_report(self):
+        """延迟分位数(毫秒)和订单吞吐量"""
+        elapsed = self._t1 - self._t0 if self._t0 is not None else 0.0
+        report = {'bars': self._nbars, 'orders': len(self.order_to_fill),
+                  'bar_rate': self._nbars / elapsed if elapsed else np.nan,
+                  'orders_per_sec': len(self.order_to_fill) / elapsed if elapsed else np.nan}
+        for name, values in (('tick_to_order', self.tick_to_order),
+                             ('order_to_fill', self.order_to_fill)):
+            lat = np.array(values) * 1000
+            for q in (50, 90, 99):
+                report[f'{name}_p{q}_ms'] = np.percentile(lat, q) if len(lat) else np.nan
+        return report
+
+
+def load_test(df, strategy, bar_rates=(0, 2000, 500), latency=0.002, cash=1000000.0, **kwargs):
+    """在不同行情回放速度下运行策略，返回每种速度的延迟和吞吐量报告"""
+    rows = []
+    for rate in bar_rates:
+        cerebro = bt.Cerebro()
+        cerebro.adddata(bt.feeds.PandasData(dataname=df), name='sim')
+        cerebro.addstrategy(strategy, **kwargs)
+        cerebro.broker = SimExchangeBroker(exchange=SimExchange(latency=latency), bar_rate=rate)
+        cerebro.broker.setcash(cash)
+        cerebro.broker.setcommission(commission=0.0003)
+        cerebro.run()
+        rows.append({'target_rate': rate or 'max', **cerebro.broker.latency_report()})
+    return pd.DataFrame(rows).set_index('target_rate')
+
+
+if __name__ == '__main__':
+    from strategy import MultiIndicatorStrategy
+    from test_CHATGPT import fetch_data
+
+    df = fetch_data(symbol="600000", start_date="20200101")
+    print(load_test(df, MultiIndicatorStrategy).to_string())
@@ -0,0 +1,154 @@
+"""行情接口共用的HTTP连接池
+
+akshare和tushare内部直接调用requests.get/requests.post，每次调用都会新建Session，
+请求完即关闭连接，几千个标的就要重复几千次TCP/TLS握手。install()把
+requests.api.request替换为共享Session上的请求：同一主机的连接保持长连接并复用，
+每个主机的连接数有上限(超出时等待空闲连接，不会无限新建)，并声明接受gzip压缩响应。
+
+stats()返回请求数、新建连接数和复用率，用于确认连接确实被复用。
+"""
+import threading
+import time
+
+import requests
+import requests.api
+from requests.adapters import HTTPAdapter
+
+# 同时保持连接池的主机数，以及每个主机的最大连接数(与筛选器的并发数相当)
+POOL_HOSTS = 32
+POOL_MAXSIZE = 16
+
+_original_request = requests.api.request
+_session = None
+_lock = threading.Lock()
+_counters = {'requests': 0, 'compressed': 0, 'errors': 0}
+
+
+def _pooled_request(method, url, **kwargs):
+    try:
+        response = _session.request(method=method, url=url, **kwargs)
+    except Exception:
+        with _lock:
+            _counters['errors'] += 1
+        raise
+    with _lock:
+        _counters['requests'] += 1
+        if response.headers.get('Content-Encoding') in ('gzip', 'deflate', 'br'):
+            _counters['compressed'] += 1
+    return response
+
+
+def install(pool_hosts=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE, max_retries=0):
+    """让进程内所有requests.get/post等顶层调用走共享连接池，重复调用无副作用"""
+    global _session
+    with _lock:
+        if _session is not None:
+            return _session
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize,
+                              max_retries=max_retries, pool_block=True)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Accept-Encoding'] = 'gzip, deflate'
+        _session = session
+    requests.api.request = _pooled_request
+    return session
+
+
+def uninstall():
+    """恢复requests的默认行为并关闭连接池"""
+    global _session
+    requests.api.request = _original_request
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+        for k in _counters:
+            _counters[k] = 0
+
+
+def stats():
+    """连接复用统计：总体和按主机的请求数/新建连接数"""
+    hosts = {}
+    if _session is not None:
+        for adapter in {id(a): a for a in _session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                hosts[f'{pool.scheme}://{pool.host}:{pool.port}'] = {
+                    'requests': pool.num_requests,
+                    'connections': pool.num_connections,
+                }
+    with _lock:
+        result = dict(_counters)
+    result['connections'] = sum(h['connections'] for h in hosts.values())
+    pooled = sum(h['requests'] for h in hosts.values())
+    result['reuse_rate'] = 1 - result['connections'] / pooled if pooled else 0.0
+    result['hosts'] = hosts
+    return result
+
+
+def print_stats():
+    s = stats()
+    print(f"HTTP请求 {s['requests']} 次，新建连接 {s['connections']} 个，"
+          f"连接复用率 {s['reuse_rate']:.1%}，压缩响应 {s['compressed']} 次，失败 {s['errors']} 次")
+
+
+def _stub_server():
+    """本地桩服务器：HTTP/1.1长连接，按请求头返回gzip压缩的JSON"""
+    import gzip
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    body = json.dumps({'data': [[i, 10.0 + i / 100] for i in range(500)]}).encode()
+    compressed = gzip.compress(body)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 响应头和正文分两次写出，长连接上不关Nagle会碰上延迟确认
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            time.sleep(0.002)
+            gz = 'gzip' in self.headers.get('Accept-Encoding', '')
+            payload = compressed if gz else body
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            if gz:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    from concurrent.futures import ThreadPoolExecutor
+
+    server = _stub_server()
+    url = f'http://127.0.0.1:{server.server_address[1]}/hist'
+    n, workers = 2000, 8
+
+    def fetch(i):
+        r = requests.get(url, params={'symbol': f'{i:06d}'}, timeout=10)
+        return len(r.json()['data'])
+
+    for mode in ('默认requests', '共享连接池'):
+        if mode == '共享连接池':
+            install(pool_maxsize=workers)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as executor:
+            rows = sum(executor.map(fetch, range(n)))
+        print(f"{mode}: {n} 次请求 {time.perf_counter() - start:.2f}s，共 {rows} 行")
+    print_stats()
+    uninstall()
+    server.shutdown()
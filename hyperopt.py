@@ -0,0 +1,160 @@
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import xgboost as xgb
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import log_loss
+
+from dataset import MinuteDataset, train_xgb_external
+from strategy import LABEL_HORIZON
+
+# 待搜索的参数空间
+RF_GRID = {
+    'n_estimators': [50, 100, 200],
+    'max_depth': [3, 5, 8],
+    'min_samples_leaf': [1, 20],
+}
+XGB_GRID = {
+    'n_estimators': [100, 200],
+    'max_depth': [3, 5, 7],
+    'learning_rate': [0.05, 0.1, 0.2],
+}
+
+# 每个工作进程只打开一次内存映射数据集，所有试验共用
+_DATASETS = {}
+
+
+def expand_grid(grid):
+    """把参数网格展开为参数字典列表"""
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*grid.values())]
+
+
+def time_series_folds(dataset, n_splits):
+    """按时间顺序切分的交叉验证折
+
+    数据集按标的依次拼接，所以在每个标的内部按时间扩展窗口切分，
+    第k折用每个标的前k段训练、第k+1段验证，避免用未来数据训练。
+    训练段末尾留出LABEL_HORIZON根bar的间隔，这些样本的标签用到了验证段的收盘价。
+    """
+    folds = []
+    for k in range(1, n_splits + 1):
+        train_idx, valid_idx = [], []
+        for sym in dataset.meta['symbols']:
+            start, end = sym['start'], sym['end']
+            step = (end - start) // (n_splits + 1)
+            if step <= LABEL_HORIZON:
+                continue
+            train_idx.append(np.arange(start, start + k * step - LABEL_HORIZON))
+            valid_idx.append(np.arange(start + k * step, start + (k + 1) * step))
+        if not train_idx:
+            raise ValueError(f"数据集中没有标的的样本数够切出{n_splits}折(每段需多于{LABEL_HORIZON}行)")
+        folds.append((np.concatenate(train_idx), np.concatenate(valid_idx)))
+    return folds
+
+
+def _load(path, n_splits):
+    key = (path, n_splits)
+    if key not in _DATASETS:
+        dataset = MinuteDataset(path)
+        _DATASETS[key] = (dataset, time_series_folds(dataset, n_splits))
+    return _DATASETS[key]
+
+
+def _sample_rows(idx, n, seed):
+    """从折的行号中不放回抽取至多n行(按行号排序，保持顺序读取内存映射)"""
+    if len(idx) <= n:
+        return idx
+    return np.sort(np.random.default_rng(seed).choice(idx, size=n, replace=False))
+
+
+def _make_model(kind, params):
+    if kind == 'rf':
+        return RandomForestClassifier(n_jobs=1, **params)
+    return xgb.XGBClassifier(n_jobs=1, tree_method='hist', **params)
+
+
+def _evaluate(path, n_splits, kind, params, fold_ids, fold_rows):
+    """在工作进程中评估一组参数，返回这些折上的平均对数损失
+
+    每折的训练段和验证段各抽取至多fold_rows行读入内存，N个工作进程的内存峰值约为
+    N倍的抽样大小，而不是N倍的训练集。同一折的抽样对所有参数组合相同，损失可以直接比较。
+    """
+    dataset, folds = _load(path, n_splits)
+    losses = []
+    for i in fold_ids:
+        train_idx, valid_idx = folds[i]
+        train_idx = _sample_rows(train_idx, fold_rows, seed=2 * i)
+        valid_idx = _sample_rows(valid_idx, fold_rows, seed=2 * i + 1)
+        y_train = dataset.y[train_idx].astype(int)
+        y_valid = dataset.y[valid_idx].astype(int)
+        model = _make_model(kind, params)
+        model.fit(dataset.X[train_idx], y_train)
+        proba = model.predict_proba(dataset.X[valid_idx])[:, -1]
+        losses.append(log_loss(y_valid, proba, labels=[0, 1]))
+    return float(np.mean(losses))
+
+
+def successive_halving(executor, path, kind, configs, n_splits, eta=3, fold_rows=1_000_000):
+    """逐轮增加验证折数，每轮只保留前1/eta的参数组合"""
+    # 每组参数已评估过的折上的损失，晋级后只补算新增的折
+    results = [{} for _ in configs]
+    alive = list(range(len(configs)))
+    r = 0
+    while True:
+        n_folds = min(n_splits, eta ** r)
+        # 从最近的折开始评估，越晚的验证段越接近实盘
+        fold_ids = list(range(n_splits - n_folds, n_splits))
+        futures = [(c, f, executor.submit(_evaluate, path, n_splits, kind,
+                                          configs[c], [f], fold_rows))
+                   for c in alive for f in fold_ids if f not in results[c]]
+        for c, f, future in futures:
+            results[c][f] = future.result()
+        scores = {c: np.mean([results[c][f] for f in fold_ids]) for c in alive}
+        alive = sorted(alive, key=scores.get)
+        print(f'[{kind}] 第{r + 1}轮 使用{n_folds}折 评估{len(alive)}组参数，'
+              f'当前最优 logloss={scores[alive[0]]:.5f} {configs[alive[0]]}')
+        if n_folds == n_splits or len(alive) == 1:
+            return configs[alive[0]], scores[alive[0]]
+        alive = alive[:max(1, len(alive) // eta)]
+        r += 1
+
+
+def search(dataset_path, n_splits=4, eta=3, max_workers=None,
+           rf_grid=RF_GRID, xgb_grid=XGB_GRID, rf_sample_rows=1_000_000, fold_rows=1_000_000):
+    """对随机森林和XGBoost做时间序列交叉验证的参数搜索，并用最优参数在全量数据上重新训练
+
+    搜索时每折至多抽取fold_rows行训练和验证，最终模型的训练方式与train_models_from_dataset相同。
+    """
+    # 在主进程切一次折，样本不够时尽早报错
+    time_series_folds(MinuteDataset(dataset_path), n_splits)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        rf_params, rf_loss = successive_halving(executor, dataset_path, 'rf',
+                                                expand_grid(rf_grid), n_splits, eta, fold_rows)
+        xgb_params, xgb_loss = successive_halving(executor, dataset_path, 'xgb',
+                                                  expand_grid(xgb_grid), n_splits, eta, fold_rows)
+    search_time = time.perf_counter() - start
+
+    # 用最优参数在全量数据上训练最终模型
+    dataset = MinuteDataset(dataset_path)
+    X, y = dataset.sample(rf_sample_rows)
+    rf_model = RandomForestClassifier(**rf_params)
+    rf_model.fit(X, y.astype(int))
+    params = {k: v for k, v in xgb_params.items() if k != 'n_estimators'}
+    xgb_model = train_xgb_external(dataset, params, num_boost_round=xgb_params['n_estimators'])
+
+    print(f'随机森林最优参数: {rf_params} logloss={rf_loss:.5f}')
+    print(f'XGBoost最优参数: {xgb_params} logloss={xgb_loss:.5f}')
+    print(f'参数搜索总耗时: {search_time:.1f}s')
+    return {
+        'rf_model': rf_model,
+        'xgb_model': xgb_model,
+        'rf_params': rf_params,
+        'xgb_params': xgb_params,
+        'rf_loss': rf_loss,
+        'xgb_loss': xgb_loss,
+        'search_time': search_time,
+    }
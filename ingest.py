@@ -0,0 +1,203 @@
+"""盘中分钟数据采集服务
+
+按固定间隔轮询一组标的的分钟数据(ak.stock_zh_a_minute)，时间列整列向量化解析，
+只把比本地最后一根bar更新的已完成分钟追加写入本地存储，每个标的一个CSV文件。
+metrics()给出每个标的的写入行数、采集延迟(bar结束到写入本地的时间)和每秒处理行数。
+"""
+import asyncio
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+STORE_DIR = os.path.join('data', 'minutes')
+TZ = 'Asia/Shanghai'
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def fetch_minute(symbol):
+    """获取单个标的(如sh600000)最近的1分钟数据"""
+    import akshare as ak
+    return ak.stock_zh_a_minute(symbol=symbol, period='1', adjust='')
+
+
+def parse_minutes(df, tz=TZ):
+    """把原始分钟数据转为以时间为索引的数值列
+
+    day列可能是毫秒时间戳或'YYYY-MM-DD HH:MM:SS'字符串，整列一次性解析；
+    毫秒时间戳按交易所时区转换，不依赖运行机器的本地时区。
+    """
+    day = df['day']
+    try:
+        millis = day.to_numpy().astype(np.int64)
+    except (ValueError, TypeError):
+        ts = pd.DatetimeIndex(pd.to_datetime(day, errors='coerce'))
+    else:
+        ts = pd.to_datetime(millis, unit='ms', utc=True).tz_convert(tz).tz_localize(None)
+    try:
+        out = df[COLUMNS].astype(np.float64)
+    except (ValueError, TypeError):
+        # 有无法转换的值时逐列宽松转换为NaN
+        out = df[COLUMNS].apply(pd.to_numeric, errors='coerce')
+    out.index = pd.DatetimeIndex(ts, name='datetime')
+    out = out[out.index.notna()]
+    return out[~out.index.duplicated(keep='last')].sort_index()
+
+
+def now_exchange(tz=TZ):
+    """交易所当地时间(不带时区)，与解析后的bar时间可直接比较"""
+    return pd.Timestamp.now(tz=tz).tz_localize(None)
+
+
+class MinuteStore:
+    """按标的追加写入的本地分钟数据"""
+
+    def __init__(self, path=STORE_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._last = {}
+
+    def _file(self, symbol):
+        return os.path.join(self.path, f'{symbol}.csv')
+
+    def last_ts(self, symbol):
+        """本地最后一根bar的时间，只读取文件末尾"""
+        if symbol not in self._last:
+            self._last[symbol] = self._read_tail(self._file(symbol))
+        return self._last[symbol]
+
+    @staticmethod
+    def _read_tail(file):
+        if not os.path.exists(file):
+            return None
+        with open(file, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            lines = f.read().splitlines()
+        if not lines:
+            return None
+        last = lines[-1].decode().split(',')[0]
+        return None if last == 'datetime' else pd.Timestamp(last)
+
+    def append(self, symbol, df):
+        """追加比本地最后一根bar更新的行，返回写入行数"""
+        last = self.last_ts(symbol)
+        if last is not None:
+            df = df[df.index > last]
+        if df.empty:
+            return 0
+        file = self._file(symbol)
+        df[COLUMNS].to_csv(file, mode='a', header=not os.path.exists(file))
+        self._last[symbol] = df.index[-1]
+        return len(df)
+
+    def read(self, symbol, start=None, end=None):
+        df = pd.read_csv(self._file(symbol), index_col='datetime', parse_dates=['datetime'])
+        return df.loc[start:end]
+
+
+class IngestionService:
+    """多标的分钟数据采集
+
+    每个标的一个轮询协程，阻塞的行情请求放到线程池，max_concurrency限制同时在途的请求数。
+    正在形成的分钟(时间不早于当前分钟)不写入，下一轮完成后再写。
+    """
+
+    def __init__(self, symbols, store=None, interval=60, max_concurrency=8, fetch=fetch_minute):
+        self.symbols = symbols
+        self.store = store or MinuteStore()
+        self.interval = interval
+        self.fetch = fetch
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.started = None
+        self.stats = {s: {'polls': 0, 'errors': 0, 'fetched': 0, 'rows': 0,
+                          'work_time': 0.0, 'lags': []} for s in symbols}
+
+    def ingest(self, symbol, raw, fetched_at=None):
+        """解析一次拉取的结果并追加写入，返回写入行数"""
+        stats = self.stats[symbol]
+        start = time.perf_counter()
+        df = parse_minutes(raw)
+        fetched_at = fetched_at if fetched_at is not None else now_exchange()
+        df = df[df.index < fetched_at.floor('min')]
+        first = stats['polls'] == 0
+        n = self.store.append(symbol, df)
+        stats['polls'] += 1
+        stats['fetched'] += len(df)
+        stats['rows'] += n
+        stats['work_time'] += time.perf_counter() - start
+        if n and not first:
+            # 首次拉取回补的是历史数据，不计入采集延迟
+            stats['lags'].append((now_exchange() - df.index[-1]).total_seconds())
+        return n
+
+    async def _poll(self, symbol):
+        loop = asyncio.get_running_loop()
+        while True:
+            tick = loop.time()
+            try:
+                async with self._semaphore:
+                    raw = await asyncio.to_thread(self.fetch, symbol)
+                await asyncio.to_thread(self.ingest, symbol, raw)
+            except Exception as e:
+                self.stats[symbol]['errors'] += 1
+                print(f'{symbol} 采集失败: {e}')
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - tick)))
+
+    async def run(self, duration=None):
+        """运行采集，duration为秒数，None表示一直运行直到被取消"""
+        self.started = time.perf_counter()
+        tasks = [asyncio.create_task(self._poll(s)) for s in self.symbols]
+        try:
+            if duration is None:
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.sleep(duration)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def metrics(self):
+        """每个标的的写入行数、最后一根bar、采集延迟(秒)和每秒处理行数"""
+        elapsed = time.perf_counter() - self.started if self.started else np.nan
+        now = now_exchange()
+        rows = []
+        for symbol, s in self.stats.items():
+            lags = np.array(s['lags'])
+            last = self.store.last_ts(symbol)
+            rows.append({
+                'symbol': symbol,
+                'polls': s['polls'],
+                'errors': s['errors'],
+                'rows': s['rows'],
+                'last_bar': last,
+                'staleness_s': (now - last).total_seconds() if last is not None else np.nan,
+                'lag_p50_s': np.percentile(lags, 50) if len(lags) else np.nan,
+                'lag_max_s': lags.max() if len(lags) else np.nan,
+                'rows_per_s': s['rows'] / elapsed if elapsed else np.nan,
+                # 解析+写入的处理速度，不含网络等待
+                'parse_rows_per_s': s['fetched'] / s['work_time'] if s['work_time'] else np.nan,
+            })
+        return pd.DataFrame(rows).set_index('symbol')
+
+
+async def main(symbols=('sh600000', 'sz000001', 'sh510300', 'sz159920'), interval=60):
+    import http_pool
+    http_pool.install()
+    service = IngestionService(list(symbols), interval=interval)
+    try:
+        await service.run()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        print(service.metrics())
+        http_pool.print_stats()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nStopping ingestion...")
@@ -0,0 +1,259 @@
+import asyncio
+import os
+import pickle
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import checkpoint
+import http_pool
+import indicators
+import rules
+
+# 与MultiIndicatorStrategy相同的参数
+DEFAULT_PARAMS = {
+    'ma_period1': 5,
+    'ma_period2': 10,
+    'cci_period': 14,
+    'bb_period': 20,
+    'bb_dev': 2,
+    'volume_ratio': 1.5,
+    'stop_loss': 0.05,
+}
+
+
+def fetch_minutes(symbol, start_date):
+    """获取单个标的从start_date起的1分钟数据"""
+    import akshare as ak
+    df = ak.stock_zh_a_hist_min_em(symbol=symbol, period='1', adjust='', start_date=start_date)
+    df = df.rename(columns={
+        '时间': 'datetime',
+        '开盘': 'open',
+        '收盘': 'close',
+        '最高': 'high',
+        '最低': 'low',
+        '成交量': 'volume'
+    })
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    return df.set_index('datetime')[['open', 'high', 'low', 'close', 'volume']]
+
+
+class SymbolState:
+    """单个标的的策略状态：流式指标、持仓、止损价和信号延迟记录，信号由rules中的规则判定"""
+
+    def __init__(self, symbol, params=None):
+        self.symbol = symbol
+        self.p = {**DEFAULT_PARAMS, **(params or {})}
+        self.ma5 = indicators.StreamingSMA(self.p['ma_period1'])
+        self.ma10 = indicators.StreamingSMA(self.p['ma_period2'])
+        self.cci = indicators.StreamingCCI(self.p['cci_period'])
+        self.bb = indicators.StreamingBollinger(self.p['bb_period'], self.p['bb_dev'])
+        self.vol_ma5 = indicators.StreamingSMA(5)
+        # 多等一根bar用于判断上穿/下穿
+        self.warmup = max(self.p['ma_period2'], self.p['cci_period'], self.p['bb_period']) + 1
+        self.nbars = 0
+        self.prev = None
+        self.last_ts = None
+        self.position = False
+        self.stop_price = None
+        self.latencies = []
+
+    def __getstate__(self):
+        # 延迟记录只用于本次运行的统计，不写入检查点
+        return {**self.__dict__, 'latencies': []}
+
+    def _update(self, ts, bar):
+        """用一根bar更新全部指标，返回(前一根bar的指标, 当前bar的指标)"""
+        open_, high, low, close, volume = bar
+        bb_mid, bb_top, bb_bot = self.bb.update(close)
+        ind = {
+            'ma5': self.ma5.update(close),
+            'ma10': self.ma10.update(close),
+            'cci': self.cci.update(high, low, close),
+            'bb_mid': bb_mid,
+            'bb_bot': bb_bot,
+            'vol_ma5': self.vol_ma5.update(volume),
+            'close': close,
+            'volume': volume,
+        }
+        prev, self.prev = self.prev, ind
+        self.nbars += 1
+        self.last_ts = ts
+        return prev, ind
+
+    def warm_up(self, df):
+        """用历史bar预热指标，不产生信号"""
+        tail = df.iloc[-self.warmup:]
+        for ts, bar in zip(tail.index, tail.itertuples(index=False)):
+            self._update(ts, tuple(bar))
+
+    def on_bar(self, ts, bar, arrival):
+        """处理一根新bar，返回'buy'/'sell'/None，并记录从bar到达到出信号的延迟"""
+        prev, ind = self._update(ts, bar)
+        if self.nbars < self.warmup:
+            return None
+
+        # 最近两根bar组成的数组交给规则求值，取最后一根的结果
+        frame = {k: np.array([prev[k], ind[k]]) for k in ind}
+        signal = None
+        if not self.position:
+            if rules.ENTRY.evaluate(frame, **self.p)[-1]:
+                signal = 'buy'
+                self.position = True
+                self.stop_price = ind['close'] * (1 - self.p['stop_loss'])
+        elif (rules.EXIT.evaluate(frame, **self.p)[-1]
+              or rules.STOP.evaluate(frame, stop_price=self.stop_price)[-1]):
+            signal = 'sell'
+            self.position = False
+            self.stop_price = None
+
+        self.latencies.append(time.perf_counter() - arrival)
+        return signal
+
+
+class LiveEngine:
+    """基于asyncio的多标的实时引擎
+
+    每个标的一个轮询协程，按interval秒的节奏并发拉取分钟数据(阻塞的akshare调用放到线程池)，
+    新完成的bar一到达就分发给该标的的SymbolState计算信号。
+    指定checkpoint_path时处理完新bar只标记状态有更新，每interval秒把全部标的的状态
+    (指标窗口、持仓、止损价)保存一次：序列化在事件循环里完成以得到一致的快照，写盘放到线程池，
+    退出时再保存一次。重启时从中恢复，只拉取最后一根已处理bar之后的数据，不再用历史数据预热。
+    """
+
+    def __init__(self, symbols, interval=15, max_concurrency=8, warmup_days=3,
+                 params=None, fetch=fetch_minutes, on_signal=None, checkpoint_path=None):
+        self.symbols = symbols
+        self.interval = interval
+        self.warmup_days = warmup_days
+        self.fetch = fetch
+        self.on_signal = on_signal or self._print_signal
+        self.checkpoint_path = checkpoint_path
+        self.states = {s: SymbolState(s, params) for s in symbols}
+        saved = checkpoint.load(checkpoint_path) if checkpoint_path else None
+        for s, state in (saved or {}).items():
+            # 参数改变后原来的指标窗口不再适用
+            if s in self.states and state.p == self.states[s].p:
+                self.states[s] = state
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._dirty = False
+        self._writing = None
+
+    def save_checkpoint(self):
+        if self.checkpoint_path:
+            checkpoint.save(self.states, self.checkpoint_path)
+
+    async def flush_checkpoint(self):
+        """状态有更新时序列化一次，在线程池中写盘"""
+        if not self.checkpoint_path or not self._dirty:
+            return
+        loop = asyncio.get_running_loop()
+        if self._writing is not None:
+            # 上一次写入可能因任务取消还在线程中进行，等它完成，保证新快照后写
+            await asyncio.shield(self._writing)
+        self._dirty = False
+        data = pickle.dumps(self.states, protocol=pickle.HIGHEST_PROTOCOL)
+        self._writing = loop.run_in_executor(None, checkpoint.write, data, self.checkpoint_path)
+        try:
+            await asyncio.shield(self._writing)
+        except Exception as e:
+            print(f'检查点写入失败: {e}')
+            self._dirty = True
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush_checkpoint()
+
+    @staticmethod
+    def _print_signal(symbol, signal, ts, bar):
+        print(f'{datetime.now():%H:%M:%S} {symbol} {ts} 信号: {signal} 收盘价: {bar[3]:.3f}')
+
+    async def _poll(self, symbol):
+        state = self.states[symbol]
+        loop = asyncio.get_running_loop()
+        if state.last_ts is None:
+            start_date = (datetime.now() - timedelta(days=self.warmup_days)).strftime('%Y-%m-%d 09:30:00')
+        else:
+            start_date = state.last_ts.strftime('%Y-%m-%d %H:%M:%S')
+        while True:
+            tick = loop.time()
+            try:
+                async with self._semaphore:
+                    df = await asyncio.to_thread(self.fetch, symbol, start_date)
+            except Exception as e:
+                print(f'{symbol} 数据获取失败: {e}')
+                df = None
+            arrival = time.perf_counter()
+
+            if df is not None and len(df) > 1:
+                # 最后一根是正在形成的bar，只分发已完成的bar
+                done = df.iloc[:-1]
+                if state.last_ts is None:
+                    # 首次拉取的历史bar只用于填充指标窗口
+                    state.warm_up(done)
+                    self._dirty = True
+                else:
+                    done = done[done.index > state.last_ts]
+                    for ts, bar in zip(done.index, done.itertuples(index=False)):
+                        signal = state.on_bar(ts, tuple(bar), arrival)
+                        if signal:
+                            self.on_signal(symbol, signal, ts, tuple(bar))
+                    if len(done):
+                        self._dirty = True
+                # 窗口已在内存中，之后只请求最近一根已处理bar之后的数据
+                if state.last_ts is not None:
+                    start_date = state.last_ts.strftime('%Y-%m-%d %H:%M:%S')
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - tick)))
+
+    async def run(self, duration=None):
+        """运行引擎，duration为秒数，None表示一直运行直到被取消"""
+        tasks = [asyncio.create_task(self._poll(s)) for s in self.symbols]
+        if self.checkpoint_path:
+            tasks.append(asyncio.create_task(self._checkpoint_loop()))
+        try:
+            if duration is None:
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.sleep(duration)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.flush_checkpoint()
+
+    def latency_report(self):
+        """每个标的从bar到达到出信号的延迟统计(毫秒)"""
+        rows = []
+        for symbol, state in self.states.items():
+            lat = np.array(state.latencies) * 1000
+            rows.append({
+                'symbol': symbol,
+                'bars': len(lat),
+                'p50_ms': np.percentile(lat, 50) if len(lat) else np.nan,
+                'p99_ms': np.percentile(lat, 99) if len(lat) else np.nan,
+                'max_ms': lat.max() if len(lat) else np.nan,
+            })
+        return pd.DataFrame(rows).set_index('symbol')
+
+
+async def main(symbols=('600000', '000001', '510300', '159920'), interval=15,
+               checkpoint_path=os.path.join(checkpoint.CHECKPOINT_DIR, 'live_engine.pkl')):
+    http_pool.install()
+    engine = LiveEngine(list(symbols), interval=interval, checkpoint_path=checkpoint_path)
+    try:
+        await engine.run()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        print(engine.latency_report())
+        http_pool.print_stats()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nStopping live trading...")
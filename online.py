@@ -0,0 +1,123 @@
+"""运行中模型的在线增量更新
+
+train_models每次在全部历史上从头训练，数据越积越多，每天重训越来越慢。
+OnlineLearner跟着策略逐bar记录特征和收盘价，等到未来horizon根bar的收盘价已知时
+按add_labels的口径生成标签；攒够batch_rows行新样本后，以当前XGBoost booster为起点
+再训练rounds轮(只追加新树，已有的树不变)，训练完成后整体替换models。
+替换是一次属性赋值，策略每根bar读取一次models，下一根bar起使用新模型。
+
+background=True(实盘)时训练在后台线程进行，XGBoost训练期间释放GIL，逐bar处理不等待；
+上一次更新还没完成时新样本继续累积，完成后一并用于下一次更新。
+background=False(回测)时在触发更新的bar上同步训练，结果可以复现。
+
+随机森林不支持增量训练，保持不变。booster每次更新增加rounds棵树，推理耗时随之缓慢增长。
+
+用法::
+
+    learner = OnlineLearner(rf_model, xgb_model)
+    cerebro.addstrategy(MLStrategy, rf_model=rf_model, xgb_model=xgb_model, online=learner)
+"""
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from strategy import LABEL_HORIZON
+
+# 模型不是XGBClassifier(如dataset.BoosterClassifier)时继续训练使用的参数
+DEFAULT_XGB_PARAMS = {'objective': 'binary:logistic', 'tree_method': 'hist',
+                      'max_depth': 5, 'learning_rate': 0.1}
+
+
+def _booster(model):
+    """XGBClassifier或BoosterClassifier中的原生Booster"""
+    return model.get_booster() if hasattr(model, 'get_booster') else model.booster
+
+
+def _train_params(model):
+    if hasattr(model, 'get_xgb_params'):
+        return {k: v for k, v in model.get_xgb_params().items() if v is not None}
+    return dict(DEFAULT_XGB_PARAMS)
+
+
+class OnlineLearner:
+    """逐bar收集带标签的样本，定期增量更新XGBoost，models为当前的(随机森林, XGBoost)"""
+
+    def __init__(self, rf_model, xgb_model, horizon=LABEL_HORIZON, threshold=0.001,
+                 batch_rows=240, rounds=10, xgb_params=None, background=True):
+        self.models = (rf_model, xgb_model)
+        self.horizon = horizon
+        self.threshold = threshold
+        self.batch_rows = batch_rows
+        self.rounds = rounds
+        self.params = xgb_params or _train_params(xgb_model)
+        self.background = background
+        self.version = 0
+        self.updates = []
+        self._recent = {}
+        self._rows = []
+        self._labels = []
+        self._executor = None
+        self._future = None
+
+    def __getstate__(self):
+        # 随检查点保存时不带线程池，正在进行的更新不保存
+        return {**self.__dict__, '_executor': None, '_future': None}
+
+    def observe(self, symbol, features, close):
+        """记录一根bar的特征和收盘价，horizon根bar之前的样本此时得到标签"""
+        recent = self._recent.get(symbol)
+        if recent is None:
+            recent = self._recent[symbol] = deque(maxlen=self.horizon + 1)
+        recent.append((features, close))
+        if len(recent) <= self.horizon:
+            return
+        features0, close0 = recent[0]
+        if np.isfinite(features0).all():
+            self._rows.append(features0)
+            self._labels.append(int(close / close0 - 1 > self.threshold))
+        if len(self._rows) >= self.batch_rows and (self._future is None or self._future.done()):
+            X, y = np.array(self._rows), np.array(self._labels)
+            self._rows, self._labels = [], []
+            if not self.background:
+                self._update(X, y)
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='online')
+            self._future = self._executor.submit(self._update, X, y)
+
+    def _update(self, X, y):
+        """以当前booster为起点在新样本上追加rounds轮，完成后替换models"""
+        import xgboost as xgb
+        from dataset import BoosterClassifier
+
+        start = time.perf_counter()
+        rf_model, xgb_model = self.models
+        booster = _booster(xgb_model)
+        try:
+            dtrain = xgb.DMatrix(X, label=y, feature_names=booster.feature_names)
+            new = xgb.train(self.params, dtrain, num_boost_round=self.rounds, xgb_model=booster)
+        except Exception as e:
+            # 更新失败时继续使用原来的模型
+            print(f'模型更新失败: {e}')
+            return
+        # BoosterClassifier按位置传入特征
+        new.feature_names = None
+        self.models = (rf_model, BoosterClassifier(new))
+        self.version += 1
+        elapsed = time.perf_counter() - start
+        self.updates.append({'version': self.version, 'rows': len(y), 'trees': new.num_boosted_rounds(),
+                             'seconds': elapsed})
+        print(f'模型更新 v{self.version}: 新样本{len(y)}行，共{new.num_boosted_rounds()}棵树，耗时{elapsed:.2f}s')
+
+    def wait(self):
+        """等待正在进行的后台更新完成"""
+        if self._future is not None:
+            self._future.result()
+
+    def close(self):
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,495 @@
+"""对齐到同一时间轴的多标的面板数据源
+
+run_backtest给每个标的一个PandasData，backtrader每根bar都要在所有数据源之间同步时间，
+标的越多开销越大；某个标的缺了几分钟，它的bar就和其他标的错开。
+Panel把全部标的预先对齐到各自时间的并集上，价格和成交量存成(时间, 标的数)数组，
+valid标记每个标的在每个时间点是否真的有bar。回测时cerebro只有一个PanelData数据源，
+每个标的由一个SymbolView代表：下单、持仓和成交都记在视图上，
+视图按数据源的当前位置直接读数组，不参与时间同步。
+
+缺失的bar按前一根收盘价补成成交量为0的平盘bar，持仓按这个价格估值。
+PanelStrategy只在标的有真实bar时产生信号；信号后的下一根bar缺失时，市价单按补出的价格成交。
+指标在每个标的自己的bar上计算后再放回对齐的时间轴，与单独数据源的口径一致。
+
+用法::
+
+    panel = Panel.from_frames(datas, names)
+    cerebro.adddata(PanelData(panel=panel, name='panel'))
+    cerebro.addstrategy(PanelMLStrategy, rf_model=rf_model, xgb_model=xgb_model)
+
+或者run_backtest(..., panel=True)。benchmark()比较面板与逐标的数据源的每bar耗时。
+"""
+import time
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+import rules
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+class Panel:
+    """对齐后的面板，open/high/low/close/volume和valid的形状都是(时间, 标的数)"""
+
+    def __init__(self, names, index, open, high, low, close, volume, valid):
+        self.names = list(names)
+        self.index = index
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.valid = valid
+
+    @classmethod
+    def from_frames(cls, frames, names=None):
+        """把各标的的OHLCV表(时间索引)对齐成面板，names默认为序号"""
+        names = list(names) if names is not None else [str(j) for j in range(len(frames))]
+        if len(names) != len(frames):
+            raise ValueError("names与数据表的数量不一致")
+        frames = [df[~df.index.duplicated(keep='last')].sort_index() if not df.empty else None
+                  for df in frames]
+        stamps = [df.index.values for df in frames if df is not None]
+        if not stamps:
+            raise ValueError("没有任何标的有数据")
+        index = pd.DatetimeIndex(np.unique(np.concatenate(stamps)), name='datetime')
+        shape = (len(index), len(frames))
+        valid = np.zeros(shape, dtype=bool)
+        fields = {c: np.full(shape, np.nan) for c in COLUMNS}
+        for j, df in enumerate(frames):
+            if df is None:
+                continue
+            rows = index.get_indexer(df.index)
+            valid[rows, j] = True
+            for c in COLUMNS:
+                fields[c][rows, j] = df[c].to_numpy(dtype=np.float64)
+        # 缺失的bar取前一根真实bar的收盘价，第一根真实bar之前保持NaN
+        last = np.where(valid, np.arange(shape[0])[:, None], 0)
+        np.maximum.accumulate(last, axis=0, out=last)
+        filled = fields['close'][last, np.arange(shape[1])]
+        missing = ~valid
+        for c in ('open', 'high', 'low', 'close'):
+            fields[c][missing] = filled[missing]
+        fields['volume'][missing] = 0.0
+        return cls(names, index, valid=valid, **fields)
+
+    def rows(self, j):
+        """第j个标的真实bar所在的行号"""
+        return np.flatnonzero(self.valid[:, j])
+
+    def bars(self, j):
+        """第j个标的自己的bar(不含补齐的bar)"""
+        rows = self.rows(j)
+        return pd.DataFrame({c: getattr(self, c)[rows, j] for c in COLUMNS}, index=self.index[rows])
+
+    def expand(self, columns, fill=np.nan):
+        """把每个标的按自己的bar计算的一维结果放回对齐的时间轴，缺失的bar填fill"""
+        columns = [np.asarray(c) for c in columns]
+        out = np.full(self.valid.shape, fill, dtype=np.result_type(*columns, type(fill)))
+        for j, values in enumerate(columns):
+            out[self.rows(j), j] = values
+        return out
+
+
+class _ViewLine:
+    """视图的一列，[0]为数据源当前位置的值，[-1]为前一根"""
+
+    __slots__ = ('values', 'feed')
+
+    def __init__(self, values, feed):
+        self.values = values
+        self.feed = feed
+
+    def __getitem__(self, ago):
+        return self.values[len(self.feed) - 1 + ago]
+
+
+class SymbolView:
+    """面板中的一个标的，作为下单、持仓和成交的data使用，不加入cerebro
+
+    提供券商、订单和交易记录用到的接口(OHLCV和时间线、长度、时区、日期转换)。
+    """
+
+    _compensate = None
+
+    def __init__(self, feed, column):
+        self.feed = feed
+        self.column = column
+        self._name = feed.panel.names[column]
+        self.datetime = feed.lines.datetime
+        for c in COLUMNS:
+            setattr(self, c, _ViewLine(getattr(feed.panel, c)[:, column], feed))
+
+    def __len__(self):
+        return len(self.feed)
+
+    def __repr__(self):
+        return f'SymbolView({self._name!r})'
+
+    @property
+    def p(self):
+        return self.feed.p
+
+    @property
+    def _tz(self):
+        return self.feed._tz
+
+    def date2num(self, dt):
+        return self.feed.date2num(dt)
+
+    def num2date(self, dt=None, tz=None, naive=True):
+        return self.feed.num2date(dt, tz, naive)
+
+
+class PanelData(bt.feeds.DataBase):
+    """按面板时间轴推进的数据源，只填时间线，views为各标的的视图"""
+
+    params = (('panel', None),)
+
+    def __init__(self):
+        self.panel = self.p.panel
+        self.views = [SymbolView(self, j) for j in range(len(self.panel.names))]
+        self._nums = [bt.date2num(dt) for dt in self.panel.index.to_pydatetime()]
+
+    def start(self):
+        super().start()
+        self._row = -1
+
+    def _load(self):
+        self._row += 1
+        if self._row >= len(self._nums):
+            return False
+        self.lines.datetime[0] = self._nums[self._row]
+        return True
+
+
+class PanelStrategy(bt.Strategy):
+    """面板数据源上的多标的策略基类
+
+    子类的signals()在回测开始时返回(入场, 离场)两个(时间, 标的数)布尔掩码。
+    next对全部标的做向量运算，只对要下单的标的调用buy/sell，
+    每根bar的Python开销基本与标的数无关。入场用可用现金的9成买入(同一根bar入场的标的依次分配)，
+    单个标的不超过总资产的max_weight；收盘价跌破入场时的止损价也离场。
+    给出risk(标的池包含面板全部标的的risk.RiskEngine)时，入场仓位再不超过引擎按已持仓标的
+    (含同一根bar先分配的标的)算出的目标权重，同时持有的标的相关性越高，每只分到的仓位越小。
+    """
+
+    params = (
+        ('stop_loss', 0.05),
+        ('max_weight', 1.0),
+        ('risk', None),
+    )
+
+    def start(self):
+        self.panel = self.data.panel
+        self.views = self.data.views
+        n = len(self.views)
+        self.held = np.zeros(n, dtype=bool)
+        self.pending = np.zeros(n, dtype=bool)
+        self.stop_price = np.full(n, np.nan)
+        self._risk_cols = None
+        if self.p.risk is not None:
+            missing = set(self.panel.names) - set(self.p.risk.symbols)
+            if missing:
+                raise ValueError(f"风险引擎的标的池缺少 {sorted(missing)}")
+            # 引擎按自己的标的顺序接收价格
+            self._risk_cols = np.array([self.panel.names.index(s) for s in self.p.risk.symbols])
+        self.entry, self.exit = self.signals()
+
+    def signals(self):
+        raise NotImplementedError
+
+    def getview(self, name):
+        return self.views[self.panel.names.index(name)]
+
+    def next(self):
+        t = len(self.data) - 1
+        close = self.panel.close[t]
+        if self.p.risk is not None:
+            self.p.risk.update(close[self._risk_cols], self.data.datetime[0])
+        idle = self.panel.valid[t] & ~self.pending
+        with np.errstate(invalid='ignore'):
+            leave = idle & self.held & (self.exit[t] | (close <= self.stop_price))
+        enter = idle & ~self.held & self.entry[t]
+        for j in np.flatnonzero(leave):
+            view = self.views[j]
+            self.sell(data=view, size=self.getposition(view).size)
+            self.pending[j] = True
+            self.stop_price[j] = np.nan
+        if enter.any():
+            cash = self.broker.getcash() * 0.9
+            value = self.broker.getvalue()
+            cap = value * self.p.max_weight
+            if self.p.risk is not None:
+                # 持有且未在卖出的，加上正在买入的
+                held = [self.panel.names[k] for k in np.flatnonzero(self.held ^ self.pending)]
+            for j in np.flatnonzero(enter):
+                amount = min(cash, cap)
+                if self.p.risk is not None:
+                    name = self.panel.names[j]
+                    amount = min(amount, self.p.risk.size(name, held, value, close[j]) * close[j])
+                    held.append(name)
+                if amount <= 0:
+                    break
+                self.buy(data=self.views[j], size=amount / close[j])
+                cash -= amount
+                self.pending[j] = True
+                self.stop_price[j] = close[j] * (1 - self.p.stop_loss)
+
+    def notify_order(self, order):
+        if order.alive():
+            return
+        j = order.data.column
+        self.pending[j] = False
+        self.held[j] = self.getposition(order.data).size > 0
+        if not self.held[j]:
+            self.stop_price[j] = np.nan
+
+
+class PanelRuleStrategy(PanelStrategy):
+    """按rules中的规则入场/离场，默认ENTRY/EXIT，即MultiIndicatorStrategy的多标的形式"""
+
+    params = (
+        ('entry_rule', rules.ENTRY),
+        ('exit_rule', rules.EXIT),
+        ('ma_period1', 5),
+        ('ma_period2', 10),
+        ('cci_period', 14),
+        ('bb_period', 20),
+        ('bb_dev', 2),
+        ('volume_ratio', 1.5),
+    )
+
+    def indicator_frame(self, j):
+        """第j个标的在自己的bar上计算的指标列"""
+        bars = self.panel.bars(j)
+        return rules.indicator_frame(bars['high'].values, bars['low'].values, bars['close'].values,
+                                     bars['volume'].values, self.p.ma_period1, self.p.ma_period2,
+                                     self.p.cci_period, self.p.bb_period, self.p.bb_dev)
+
+    def rule_signals(self, frames):
+        """各标的的规则掩码放回对齐的时间轴"""
+        entry = [self.p.entry_rule.evaluate(f, volume_ratio=self.p.volume_ratio) for f in frames]
+        exit = [self.p.exit_rule.evaluate(f, volume_ratio=self.p.volume_ratio) for f in frames]
+        return self.panel.expand(entry, False), self.panel.expand(exit, False)
+
+    def signals(self):
+        return self.rule_signals([self.indicator_frame(j) for j in range(len(self.views))])
+
+
+class PanelMLStrategy(PanelRuleStrategy):
+    """MLStrategy的面板版本：技术指标信号加两个模型的平均上涨概率确认
+
+    全部标的全部bar的特征在开始时拼成一个矩阵，每个模型只调用一次predict_proba。
+    指标来自indicators模块，与训练特征、MLStrategy和实盘引擎一致。
+    """
+
+    params = (
+        ('rf_model', None),
+        ('xgb_model', None),
+        ('entry_prob', 0.7),
+        ('exit_prob', 0.3),
+    )
+
+    def features(self, j, frame):
+        """与MLStrategy.get_features口径一致的特征矩阵"""
+        bars = self.panel.bars(j)
+        close, high, low, open_ = (bars[c].values for c in ('close', 'high', 'low', 'open'))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.column_stack([
+                frame['ma5'] / frame['ma10'] - 1,
+                frame['cci'],
+                (close - frame['bb_mid']) / frame['bb_mid'],
+                frame['volume'] / frame['vol_ma5'] - 1,
+                (high - low) / low,
+                (close - open_) / open_,
+            ])
+
+    def signals(self):
+        frames = [self.indicator_frame(j) for j in range(len(self.views))]
+        entry, exit = self.rule_signals(frames)
+        # 指标窗口未满的bar没有预测，概率为NaN，不触发入场或离场
+        X = np.full(self.panel.valid.shape + (6,), np.nan)
+        for j, f in enumerate(frames):
+            X[self.panel.rows(j), j] = self.features(j, f)
+        ok = np.isfinite(X).all(axis=2)
+        prob = np.full(ok.shape, np.nan)
+        if ok.any():
+            rows = X[ok]
+            prob[ok] = (self.p.rf_model.predict_proba(rows)[:, 1]
+                        + self.p.xgb_model.predict_proba(rows)[:, 1]) / 2
+        with np.errstate(invalid='ignore'):
+            return entry & (prob > self.p.entry_prob), exit | (prob < self.p.exit_prob)
+
+
+class _FeedLoopStrategy(bt.Strategy):
+    """benchmark的对照组：每个标的一个数据源，逐个数据源执行与PanelStrategy相同的逻辑"""
+
+    params = (
+        ('entry', None),  # 每个标的按自己的bar排列的入场/离场掩码
+        ('exit', None),
+        ('stop_loss', 0.05),
+        ('max_weight', 1.0),
+    )
+
+    def start(self):
+        n = len(self.datas)
+        self.held = [False] * n
+        self.pending = [False] * n
+        self.stop_price = [None] * n
+
+    def next(self):
+        now = max(d.datetime[0] for d in self.datas)
+        current = [(j, d, len(d) - 1) for j, d in enumerate(self.datas)
+                   if d.datetime[0] == now and not self.pending[j]]
+        for j, d, i in current:
+            if self.held[j] and (self.p.exit[j][i] or d.close[0] <= self.stop_price[j]):
+                self.sell(data=d, size=self.getposition(d).size)
+                self.pending[j] = True
+                self.stop_price[j] = None
+        cash = None
+        for j, d, i in current:
+            if not self.held[j] and not self.pending[j] and self.p.entry[j][i]:
+                if cash is None:
+                    cash = self.broker.getcash() * 0.9
+                    cap = self.broker.getvalue() * self.p.max_weight
+                amount = min(cash, cap)
+                if amount <= 0:
+                    break
+                self.buy(data=d, size=amount / d.close[0])
+                cash -= amount
+                self.pending[j] = True
+                self.stop_price[j] = d.close[0] * (1 - self.p.stop_loss)
+
+    def notify_order(self, order):
+        if order.alive():
+            return
+        j = self.datas.index(order.data)
+        self.pending[j] = False
+        self.held[j] = self.getposition(order.data).size > 0
+
+
+def _synthetic_frames(n_symbols, bars, missing, seed):
+    """随机游走的分钟数据，每个标的随机删掉missing比例的bar"""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2023-08-01 09:31', periods=bars, freq='min')
+    frames = []
+    for _ in range(n_symbols):
+        close = 10 * np.exp(np.cumsum(rng.normal(0, 0.002, bars)))
+        open_ = np.r_[close[0], close[:-1]]
+        spread = np.abs(rng.normal(0, 0.001, bars)) * close
+        df = pd.DataFrame({
+            'open': open_,
+            'high': np.maximum(open_, close) + spread,
+            'low': np.minimum(open_, close) - spread,
+            'close': close,
+            'volume': rng.lognormal(10, 1, bars),
+        }, index=index)
+        frames.append(df[rng.random(bars) >= missing])
+    return frames
+
+
+def _run(cerebro, cash):
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=0.0003)
+    start = time.perf_counter()
+    cerebro.run()
+    return time.perf_counter() - start, cerebro.broker.getvalue()
+
+
+def benchmark(sizes=(10, 50, 200), bars=2400, missing=0.02, cash=1000000.0, seed=0,
+              entry_rule=rules.SCREEN, exit_rule=rules.EXIT):
+    """同样的规则信号分别用面板数据源和逐标的PandasData回测，打印每根bar的耗时和最终资金
+
+    默认入场用较宽松的SCREEN规则，随机数据上也有足够的成交。
+    两边的入场/离场掩码相同，差别只在数据源和逐标的循环；
+    有缺失bar时两边对缺失bar上的成交价处理不同，最终资金会略有差异。
+    """
+    print(f"{'标的数':>6s} {'面板(ms/bar)':>13s} {'逐标的(ms/bar)':>15s} {'加速':>6s} {'面板资金':>14s} {'逐标的资金':>14s}")
+    results = []
+    for n in sizes:
+        frames = _synthetic_frames(n, bars, missing, seed)
+        panel = Panel.from_frames(frames, [f'S{j:04d}' for j in range(n)])
+
+        cerebro = bt.Cerebro(stdstats=False)
+        cerebro.adddata(PanelData(panel=panel, name='panel'))
+        cerebro.addstrategy(PanelRuleStrategy, entry_rule=entry_rule, exit_rule=exit_rule)
+        t_panel, v_panel = _run(cerebro, cash)
+
+        # 对照组使用同一套指标和规则，按各标的自己的bar排列
+        volume_ratio = rules.DEFAULT_PARAMS['volume_ratio']
+        entry, exit = [], []
+        for df in frames:
+            frame = rules.indicator_frame(df['high'].values, df['low'].values, df['close'].values,
+                                          df['volume'].values)
+            entry.append(entry_rule.evaluate(frame, volume_ratio=volume_ratio))
+            exit.append(exit_rule.evaluate(frame, volume_ratio=volume_ratio))
+        cerebro = bt.Cerebro(stdstats=False)
+        for df, name in zip(frames, panel.names):
+            cerebro.adddata(bt.feeds.PandasData(dataname=df, name=name))
+        cerebro.addstrategy(_FeedLoopStrategy, entry=entry, exit=exit)
+        t_feeds, v_feeds = _run(cerebro, cash)
+
+        T = len(panel.index)
+        print(f"{n:6d} {t_panel / T * 1e3:13.3f} {t_feeds / T * 1e3:15.3f} {t_feeds / t_panel:5.1f}x "
+              f"{v_panel:14.2f} {v_feeds:14.2f}")
+        results.append({'symbols': n, 'bars': T, 'panel_s': t_panel, 'feeds_s': t_feeds,
+                        'panel_value': v_panel, 'feeds_value': v_feeds})
+    return results
+
+
+class _EnterAtStrategy(PanelStrategy):
+    """在同一根bar上买入columns中的标的，之后一直持有"""
+
+    params = (
+        ('bar', 0),
+        ('columns', ()),
+    )
+
+    def signals(self):
+        entry = np.zeros(self.panel.valid.shape, dtype=bool)
+        entry[self.p.bar, list(self.p.columns)] = True
+        return entry, np.zeros_like(entry)
+
+
+def risk_sizing_check(n=3, bars=400, cash=1000000.0, seed=0):
+    """同一根bar入场n个高度相关的标的和n个互不相关的标的，打印风险引擎分给各标的的金额
+
+    两组标的波动率相同，相关的一组组合波动率更高，先入场的标的挤占风险预算，
+    之后的标的分到的仓位应小于不相关一组的对应标的。返回两组金额和是否满足这一点。
+    """
+    from risk import RiskEngine
+
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2023-08-01 09:31', periods=bars, freq='min')
+    common = rng.normal(0, 0.002, bars)
+    returns = [common + rng.normal(0, 0.0003, bars) for _ in range(n)]
+    returns += [rng.normal(0, 0.002, bars) for _ in range(n)]
+    frames = []
+    for r in returns:
+        close = 10 * np.exp(np.cumsum(r))
+        frames.append(pd.DataFrame({'open': close, 'high': close, 'low': close, 'close': close,
+                                    'volume': 1e5}, index=index))
+    names = [f'C{j}' for j in range(n)] + [f'I{j}' for j in range(n)]
+
+    amounts = {}
+    for group, columns in (('相关', range(n)), ('不相关', range(n, 2 * n))):
+        cerebro = bt.Cerebro(stdstats=False)
+        cerebro.adddata(PanelData(panel=Panel.from_frames(frames, names), name='panel'))
+        cerebro.addstrategy(_EnterAtStrategy, bar=bars - 2, columns=tuple(columns),
+                            risk=RiskEngine(names))
+        cerebro.broker.setcash(cash)
+        strat = cerebro.run()[0]
+        amounts[group] = [strat.getposition(strat.views[j]).size * strat.panel.close[-1][j]
+                          for j in columns]
+        print(f"{group:>4s}: " + '  '.join(f'{a:12.2f}' for a in amounts[group]))
+    ok = all(c < i for c, i in zip(amounts['相关'][1:], amounts['不相关'][1:]))
+    print(f"相关标的同时持有时仓位更小: {ok}")
+    return {'correlated': amounts['相关'], 'independent': amounts['不相关'], 'ok': ok}
+
+
+if __name__ == '__main__':
+    benchmark()
+    risk_sizing_check()
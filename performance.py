@@ -0,0 +1,162 @@
+import numpy as np
+import backtrader as bt
+
+# A股每天240根分钟线，全年约252个交易日
+BARS_PER_DAY = 240
+PERIODS_PER_YEAR_DAILY = 252
+PERIODS_PER_YEAR_MINUTE = BARS_PER_DAY * PERIODS_PER_YEAR_DAILY
+
+
+class EquityRecorder(bt.Analyzer):
+    """回测过程中只记录净值、成交额和平仓盈亏，所有统计在回测结束后用数组一次算完"""
+
+    def start(self):
+        self._dt = []
+        self._equity = []
+        self._traded = []
+        self._trade_pnl = []
+        self._pending_traded = 0.0
+        self._fills = []
+
+    def notify_order(self, order):
+        if order.status == order.Completed:
+            self._pending_traded += abs(order.executed.size * order.executed.price)
+            # 面板回测中order.data是标的视图，记录它在面板中的列号
+            data_id = next((i for i, d in enumerate(self.strategy.datas) if d is order.data),
+                           getattr(order.data, 'column', -1))
+            self._fills.append((order.executed.dt, order.executed.price, order.executed.size, data_id))
+
+    def notify_trade(self, trade):
+        if trade.isclosed:
+            self._trade_pnl.append(trade.pnlcomm)
+
+    def next(self):
+        self._dt.append(self.data.datetime[0])
+        self._equity.append(self.strategy.broker.getvalue())
+        self._traded.append(self._pending_traded)
+        self._pending_traded = 0.0
+
+    def get_arrays(self):
+        """返回净值曲线、每bar成交额和逐笔盈亏数组"""
+        return {
+            'datetime': np.asarray(self._dt, dtype=np.float64),
+            'equity': np.asarray(self._equity, dtype=np.float64),
+            'traded': np.asarray(self._traded, dtype=np.float64),
+            'trade_pnl': np.asarray(self._trade_pnl, dtype=np.float64),
+        }
+
+    def get_fills(self):
+        """返回每笔成交的时间、价格、数量(卖出为负)和数据源序号(面板回测中为标的列号)"""
+        fills = np.asarray(self._fills, dtype=np.float64).reshape(-1, 4)
+        return {
+            'datetime': fills[:, 0],
+            'price': fills[:, 1],
+            'size': fills[:, 2],
+            'data': fills[:, 3].astype(np.int64),
+        }
+
+    def get_analysis(self):
+        return self.get_arrays()
+
+
+def returns(equity):
+    """逐bar收益率，支持一维(单次回测)或二维(多次回测 x bar)净值数组"""
+    equity = np.asarray(equity, dtype=np.float64)
+    return equity[..., 1:] / equity[..., :-1] - 1
+
+
+def sharpe_ratio(rets, periods_per_year=PERIODS_PER_YEAR_MINUTE, risk_free=0.0):
+    """年化夏普比率"""
+    excess = rets - risk_free / periods_per_year
+    std = excess.std(axis=-1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = excess.mean(axis=-1) / std * np.sqrt(periods_per_year)
+    return np.where(std > 0, sharpe, np.nan)
+
+
+def sortino_ratio(rets, periods_per_year=PERIODS_PER_YEAR_MINUTE, risk_free=0.0):
+    """年化索提诺比率，只用下行波动作分母"""
+    excess = rets - risk_free / periods_per_year
+    downside = np.sqrt(np.mean(np.minimum(excess, 0.0) ** 2, axis=-1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sortino = excess.mean(axis=-1) / downside * np.sqrt(periods_per_year)
+    return np.where(downside > 0, sortino, np.nan)
+
+
+def drawdown(equity):
+    """最大回撤(正数)和最长水下持续bar数"""
+    equity = np.asarray(equity, dtype=np.float64)
+    peak = np.maximum.accumulate(equity, axis=-1)
+    dd = equity / peak - 1
+    # 每个bar距离最近一次创新高的bar数即为当前水下持续时间
+    idx = np.arange(equity.shape[-1])
+    last_peak = np.maximum.accumulate(np.where(dd >= 0, idx, 0), axis=-1)
+    duration = idx - last_peak
+    return 0.0 - dd.min(axis=-1), duration.max(axis=-1)
+
+
+def win_rate(trade_pnl):
+    """胜率，二维输入时用NaN补齐不同回测的交易笔数"""
+    trade_pnl = np.asarray(trade_pnl, dtype=np.float64)
+    n = np.sum(~np.isnan(trade_pnl), axis=-1)
+    wins = np.sum(trade_pnl > 0, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = wins / n
+    return np.where(n > 0, rate, np.nan)
+
+
+def turnover(traded, equity):
+    """换手率：累计成交额 / 平均净值"""
+    traded = np.asarray(traded, dtype=np.float64)
+    equity = np.asarray(equity, dtype=np.float64)
+    return traded.sum(axis=-1) / equity.mean(axis=-1)
+
+
+def pad_trades(trade_pnls):
+    """把多次回测长度不一的逐笔盈亏补齐成二维数组"""
+    width = max((len(p) for p in trade_pnls), default=0)
+    out = np.full((len(trade_pnls), width), np.nan)
+    for i, pnl in enumerate(trade_pnls):
+        out[i, :len(pnl)] = pnl
+    return out
+
+
+def compute_metrics(equity, trade_pnl=None, traded=None,
+                    periods_per_year=PERIODS_PER_YEAR_MINUTE, risk_free=0.0, **_):
+    """计算全部绩效指标
+
+    equity为一维时返回标量指标，为二维(回测数 x bar数)时每个指标返回一维数组，
+    便于对成千上万组参数扫描结果一次性评估而无需重新回测。
+    """
+    equity = np.asarray(equity, dtype=np.float64)
+    rets = returns(equity)
+    max_dd, max_dd_duration = drawdown(equity)
+    metrics = {
+        'total_return': equity[..., -1] / equity[..., 0] - 1,
+        'sharpe': sharpe_ratio(rets, periods_per_year, risk_free),
+        'sortino': sortino_ratio(rets, periods_per_year, risk_free),
+        'max_drawdown': max_dd,
+        'max_drawdown_duration': max_dd_duration,
+    }
+    if traded is not None:
+        metrics['turnover'] = turnover(traded, equity)
+    if trade_pnl is not None:
+        if equity.ndim == 2 and not isinstance(trade_pnl, np.ndarray):
+            trade_pnl = pad_trades(trade_pnl)
+        trade_pnl = np.asarray(trade_pnl, dtype=np.float64)
+        metrics['trades'] = np.sum(~np.isnan(trade_pnl), axis=-1)
+        metrics['win_rate'] = win_rate(trade_pnl)
+    if equity.ndim == 1:
+        metrics = {k: np.asarray(v).item() for k, v in metrics.items()}
+    return metrics
+
+
+def print_metrics(metrics):
+    """打印单次回测的绩效指标"""
+    print(f"总收益率: {metrics['total_return']:.2%}")
+    print(f"夏普比率: {metrics['sharpe']:.2f}  索提诺比率: {metrics['sortino']:.2f}")
+    print(f"最大回撤: {metrics['max_drawdown']:.2%}  最长回撤持续: {metrics['max_drawdown_duration']} bars")
+    if 'turnover' in metrics:
+        print(f"换手率: {metrics['turnover']:.2f}")
+    if 'win_rate' in metrics:
+        print(f"交易次数: {metrics['trades']}  胜率: {metrics['win_rate']:.2%}")
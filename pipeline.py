@@ -0,0 +1,215 @@
+"""按配置运行的实验流水线
+
+fetch → features → labels → train → backtest → report 六个阶段，每个阶段的输出保存在
+{path}/{阶段}/{键}.pkl，键是(阶段名, 阶段配置, 阶段版本, 上游阶段的键)的哈希。
+输入和配置不变时直接读取结果，上游只在下游没有缓存时才读取；改动某个阶段的配置，
+只有它和下游的阶段重新计算。例如只改验证区间时，取数、特征、标签和训练都不再执行，
+只重跑回测和报告。
+
+取数阶段按标的取回数据源当前能提供的全部分钟数据，以asof(取数日期)区分版本；
+特征和标签在整段数据上计算，训练和回测从中截取各自的区间。
+修改某个阶段的计算代码后，把STAGE_VERSIONS中对应的版本号加一，旧缓存随之失效。
+
+用法::
+
+    python pipeline.py                 # DEFAULT_CONFIG
+    python pipeline.py config.json     # 与DEFAULT_CONFIG合并后运行
+"""
+import copy
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+import strategy
+import telemetry
+from performance import print_metrics
+
+PIPELINE_DIR = os.path.join('data', 'pipeline')
+STAGE_VERSIONS = {'fetch': 1, 'features': 3, 'labels': 1, 'train': 2, 'backtest': 4, 'report': 1}
+
+DEFAULT_CONFIG = {
+    'codes': ['000001.SZ', '600000.SH'],
+    'asof': None,  # 取数日期，None为当天
+    'labels': {'horizon': strategy.LABEL_HORIZON, 'threshold': 0.001},
+    'train': {'start': '20230801', 'end': '20230815', 'rf_params': None, 'xgb_params': None},
+    'backtest': {'start': '20230816', 'end': '20230831', 'cash': 1000000.0,
+                 'talib_lines': False, 'params': {}},
+}
+
+
+def merge_config(base, override):
+    """递归合并配置，override中的项覆盖base"""
+    merged = copy.deepcopy(base)
+    for k, v in (override or {}).items():
+        if isinstance(v, dict) and isinstance(merged.get(k), dict):
+            merged[k] = merge_config(merged[k], v)
+        else:
+            merged[k] = v
+    return merged
+
+
+def _save(value, file):
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    tmp = file + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, file)
+
+
+def _load(file):
+    with open(file, 'rb') as f:
+        return pickle.load(f)
+
+
+class Stage:
+    """流水线中的一个阶段，value()在有缓存时读取，否则先取上游的值再计算并保存"""
+
+    def __init__(self, pipeline, name, config, inputs, compute, symbol=None):
+        self.pipeline = pipeline
+        self.name = name
+        self.symbol = symbol
+        self.inputs = inputs
+        self.compute = compute
+        spec = {'stage': name, 'version': STAGE_VERSIONS[name], 'config': config,
+                'inputs': [s.key for s in inputs]}
+        self.key = hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        self.file = os.path.join(pipeline.path, name, f'{self.key}.pkl')
+        self._value = None
+        self._done = False
+
+    def value(self):
+        if not self._done:
+            if os.path.exists(self.file):
+                start = time.perf_counter()
+                with telemetry.stage(self.name, self.symbol):
+                    self._value = _load(self.file)
+                status = 'cached'
+            else:
+                args = [s.value() for s in self.inputs]
+                start = time.perf_counter()
+                with telemetry.stage(self.name, self.symbol):
+                    self._value = self.compute(*args)
+                    _save(self._value, self.file)
+                status = 'computed'
+            self._done = True
+            self.pipeline.log.append((self.name, self.key, status, time.perf_counter() - start))
+        return self._value
+
+
+def _fetch(code):
+    df = strategy.fetch_minute_bars(code)
+    if df.empty:
+        raise ValueError(f"No data retrieved for {code}")
+    return df[['open', 'high', 'low', 'close', 'volume']]
+
+
+def _features(df):
+    return strategy.add_features(df.copy(), labels=False)
+
+
+def _labels(df, horizon, threshold):
+    return strategy.add_labels(df[['close']].copy(), horizon, threshold)['target']
+
+
+def _train(start, end, horizon, rf_params, xgb_params, *frames):
+    n = len(frames) // 2
+    parts = []
+    for features, target in zip(frames[:n], frames[n:]):
+        part = strategy.select_dates(features.assign(target=target), start, end)
+        # 窗口末尾的标签要看到窗口之外的价格，不参与训练
+        parts.append(part.iloc[:-horizon])
+    train_data = pd.concat(parts)
+    if train_data.empty:
+        raise ValueError(f"训练区间 {start}~{end} 没有数据")
+    return strategy.train_models(train_data, rf_params, xgb_params)
+
+
+def _backtest(codes, start, end, cash, talib_lines, params, models, *features):
+    datas = [strategy.select_dates(df, start, end) for df in features]
+    strat, metrics = strategy.run_backtest(datas, *models, cash=cash, talib_lines=talib_lines,
+                                           names=codes, **params)
+    equity = strat.analyzers.equity
+    return {'final_value': strat.broker.getvalue(), 'metrics': metrics,
+            'arrays': equity.get_arrays(), 'fills': equity.get_fills()}
+
+
+def _report(config, result):
+    return {
+        'codes': ', '.join(config['codes']),
+        'train': f"{config['train']['start']}~{config['train']['end']}",
+        'backtest': f"{config['backtest']['start']}~{config['backtest']['end']}",
+        'final_value': result['final_value'],
+        **result['metrics'],
+    }
+
+
+class Pipeline:
+    """一份配置对应的全部阶段，run()返回报告(dict)"""
+
+    def __init__(self, config=None, path=PIPELINE_DIR):
+        self.config = merge_config(DEFAULT_CONFIG, config)
+        if self.config['asof'] is None:
+            self.config['asof'] = datetime.now().strftime('%Y%m%d')
+        self.path = path
+        self.log = []
+        self._build()
+
+    def _build(self):
+        c = self.config
+        codes = c['codes']
+        fetch = [Stage(self, 'fetch', {'code': code, 'asof': c['asof']}, [],
+                       lambda code=code: _fetch(code), code) for code in codes]
+        features = [Stage(self, 'features', {'columns': strategy.FEATURES}, [f], _features, f.symbol)
+                    for f in fetch]
+        labels = [Stage(self, 'labels', c['labels'], [f],
+                        lambda df: _labels(df, c['labels']['horizon'], c['labels']['threshold']),
+                        f.symbol)
+                  for f in fetch]
+        t = c['train']
+        self.train = Stage(self, 'train', {**t, 'horizon': c['labels']['horizon']}, features + labels,
+                           lambda *frames: _train(t['start'], t['end'], c['labels']['horizon'],
+                                                  t['rf_params'], t['xgb_params'], *frames))
+        b = c['backtest']
+        self.backtest = Stage(self, 'backtest', {**b, 'codes': codes}, [self.train] + features,
+                              lambda models, *frames: _backtest(codes, b['start'], b['end'], b['cash'],
+                                                                b['talib_lines'], b['params'],
+                                                                models, *frames))
+        self.report = Stage(self, 'report', {}, [self.backtest], lambda result: _report(c, result))
+
+    def run(self):
+        return self.report.value()
+
+    def print_log(self):
+        for name, key, status, elapsed in self.log:
+            print(f"{name:10s} {key}  {'缓存' if status == 'cached' else '计算'}  {elapsed:8.2f}s")
+
+
+@telemetry.instrument('pipeline')
+def run(config=None, path=PIPELINE_DIR):
+    """运行一份配置，打印绩效指标和各阶段的缓存情况，返回报告
+
+    telemetry_path给出时同时记录各阶段的耗时和内存(见telemetry)。
+    """
+    pipeline = Pipeline(config, path)
+    report = pipeline.run()
+    print(f"{report['codes']}  训练 {report['train']}  回测 {report['backtest']}")
+    print(f"最终资金: {report['final_value']:.2f}")
+    print_metrics(report)
+    pipeline.print_log()
+    return report
+
+
+if __name__ == '__main__':
+    import http_pool
+    http_pool.install()
+    config = None
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as f:
+            config = json.load(f)
+    run(config)
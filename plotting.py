@@ -0,0 +1,124 @@
+"""回测结果的降采样绘图
+
+cerebro.plot()把每根bar都交给matplotlib，多年分钟数据要画几分钟、占用大量内存，
+在没有显示器的服务器上还会卡住。这里按输出图片的像素宽度降采样：
+价格按等长分桶取最高/最低(OHLC分桶)画出每桶的波动范围，收盘价和净值曲线用LTTB
+选出视觉上最重要的点；成交标记按原始成交时间和价格绘制，不参与降采样。
+结果直接写成静态图片(Agg后端，不依赖图形界面)，耗时只与图片宽度有关，与bar数无关。
+"""
+import numpy as np
+
+from performance import EquityRecorder
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets降采样，返回被选中点的下标
+
+    首尾两点保留，中间按等长分成n_out-2个桶，每桶选与前一个选中点、
+    下一桶均值点构成三角形面积最大的点。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 下一个桶的均值点，最后一个桶的下一个"桶"就是末点
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[nlo:nhi].mean()
+        avg_y = y[nlo:nhi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+
+def ohlc_buckets(open_, high, low, close, n_buckets):
+    """把bar按等长分桶合并，返回(每桶起始下标, 开, 高, 低, 收)"""
+    n = len(close)
+    starts = np.unique(np.linspace(0, n, min(n_buckets, n), endpoint=False).astype(np.int64))
+    ends = np.r_[starts[1:], n]
+    return (starts,
+            np.asarray(open_)[starts],
+            np.maximum.reduceat(np.asarray(high, dtype=np.float64), starts),
+            np.minimum.reduceat(np.asarray(low, dtype=np.float64), starts),
+            np.asarray(close)[ends - 1])
+
+
+def _line(data, name):
+    line = getattr(data.lines, name)
+    return np.asarray(line.array[:len(data)], dtype=np.float64)
+
+
+def _fills_of(recorder, data_id):
+    fills = recorder.get_fills()
+    mask = fills['data'] == data_id
+    return {k: v[mask] for k, v in fills.items()}
+
+
+def plot_backtest(strat, path='backtest.png', width=1600, height=900, dpi=100):
+    """把回测结果画成静态图片：每个数据源一个价格面板，最后一个面板是净值曲线
+
+    strat需要挂有performance.EquityRecorder分析器。横轴按bar序号排列(与cerebro.plot一致，
+    不显示非交易时段)，刻度标签显示对应时间。返回图片路径。
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import FuncFormatter
+    from backtrader.utils import num2date
+
+    recorder = next((a for a in strat.analyzers if isinstance(a, EquityRecorder)), None)
+    if recorder is None:
+        raise ValueError("plot_backtest需要策略挂有EquityRecorder分析器")
+    arrays = recorder.get_arrays()
+    # 以第一个数据源的全部bar为横轴，净值从策略预热结束后才开始记录
+    clock = _line(strat.datas[0], 'datetime')
+    n_points = width
+
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    FigureCanvasAgg(fig)
+    n_panels = len(strat.datas) + 1
+    axes = fig.subplots(n_panels, 1, sharex=True,
+                        gridspec_kw={'height_ratios': [3] * (n_panels - 1) + [2]})
+    axes = np.atleast_1d(axes)
+
+    for ax, (data_id, data) in zip(axes, enumerate(strat.datas)):
+        dt = _line(data, 'datetime')
+        x = np.searchsorted(clock, dt)
+        close = _line(data, 'close')
+        starts, _, hi, lo, _ = ohlc_buckets(_line(data, 'open'), _line(data, 'high'),
+                                            _line(data, 'low'), close, n_points // 2)
+        ax.vlines(x[starts], lo, hi, color='0.75', linewidth=1)
+        idx = lttb(x, close, n_points)
+        ax.plot(x[idx], close[idx], color='tab:blue', linewidth=0.8)
+
+        fills = _fills_of(recorder, data_id)
+        fx = np.searchsorted(clock, fills['datetime'])
+        buys = fills['size'] > 0
+        ax.scatter(fx[buys], fills['price'][buys], marker='^', color='tab:red', s=30, zorder=3)
+        ax.scatter(fx[~buys], fills['price'][~buys], marker='v', color='tab:green', s=30, zorder=3)
+        ax.set_ylabel(data._name or f'data{data_id}')
+        ax.grid(alpha=0.3)
+
+    equity = arrays['equity']
+    x = np.searchsorted(clock, arrays['datetime'])
+    idx = lttb(x, equity, n_points)
+    axes[-1].plot(x[idx], equity[idx], color='tab:orange', linewidth=0.8)
+    axes[-1].set_ylabel('equity')
+    axes[-1].grid(alpha=0.3)
+
+    def fmt(value, pos):
+        i = int(round(value))
+        if 0 <= i < len(clock):
+            return num2date(clock[i]).strftime('%Y-%m-%d %H:%M')
+        return ''
+    axes[-1].xaxis.set_major_formatter(FuncFormatter(fmt))
+    fig.autofmt_xdate()
+    fig.savefig(path)
+    print(f"回测图已保存: {path} ({len(clock)} 根bar)")
+    return path
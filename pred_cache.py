@@ -0,0 +1,104 @@
+"""模型预测概率的持久化缓存
+
+同一组模型对同一根bar的预测概率是确定的，只调整入场/离场概率阈值、volume_ratio、
+stop_loss等规则参数重复回测时，推理结果完全相同。缓存以
+(模型指纹, 特征来源及参数, 标的, bar时间)为键保存随机森林和XGBoost的上涨概率，
+MLStrategy先查缓存，只对未命中的bar做推理，规则参数扫描从第二次运行起完全跳过推理。
+
+存储布局: {path}/{模型指纹}/{特征来源及参数}/{标的}.npz，每个文件包含时间和两列概率。
+文件读取失败(损坏或写了一半)时按未命中处理，flush时重新写入。
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+CACHE_DIR = os.path.join('data', 'pred_cache')
+
+
+def model_fingerprint(*models):
+    """模型序列化内容的哈希，重新训练或更换参数后指纹随之改变"""
+    return hashlib.sha1(pickle.dumps(models)).hexdigest()[:16]
+
+
+class _Series:
+    """单个标的的预测缓存，内存中为{bar时间: (rf概率, xgb概率)}"""
+
+    def __init__(self, file):
+        self.file = file
+        self.values = self._load()
+        self._new = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        if not os.path.exists(self.file):
+            return {}
+        try:
+            with np.load(self.file) as f:
+                return dict(zip(f['ts'].tolist(), zip(f['rf'].tolist(), f['xgb'].tolist())))
+        except Exception as e:
+            print(f"预测缓存 {self.file} 读取失败，按未命中处理: {e}")
+            return {}
+
+    def get(self, ts):
+        value = self.values.get(ts)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, ts, rf_prob, xgb_prob):
+        self.values[ts] = self._new[ts] = (rf_prob, xgb_prob)
+
+    def flush(self):
+        """把新增的预测合并进磁盘文件，先重新读取以保留其他进程写入的部分"""
+        if not self._new:
+            return
+        merged = {**self._load(), **self.values}
+        ts = np.array(sorted(merged), dtype=np.float64)
+        probs = np.array([merged[t] for t in ts.tolist()], dtype=np.float64).reshape(-1, 2)
+        os.makedirs(os.path.dirname(self.file), exist_ok=True)
+        # 每次写入用独立的临时文件，多个进程同时flush不会互相覆盖写了一半的文件
+        fd, tmp = tempfile.mkstemp(suffix='.tmp.npz', dir=os.path.dirname(self.file))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, ts=ts, rf=probs[:, 0], xgb=probs[:, 1])
+            os.replace(tmp, self.file)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.values = merged
+        self._new = {}
+
+
+class PredictionCache:
+    """一组模型的预测缓存，series(标的, 特征参数)返回该标的的缓存"""
+
+    def __init__(self, fingerprint, path=CACHE_DIR):
+        self.fingerprint = fingerprint
+        self.path = os.path.join(path, fingerprint)
+        self._series = {}
+
+    @classmethod
+    def for_models(cls, rf_model, xgb_model, path=CACHE_DIR):
+        return cls(model_fingerprint(rf_model, xgb_model), path)
+
+    def series(self, symbol, spec='default'):
+        key = (symbol, spec)
+        if key not in self._series:
+            self._series[key] = _Series(os.path.join(self.path, spec, f'{symbol}.npz'))
+        return self._series[key]
+
+    def flush(self):
+        for s in self._series.values():
+            s.flush()
+
+    def stats(self):
+        hits = sum(s.hits for s in self._series.values())
+        misses = sum(s.misses for s in self._series.values())
+        return {'hits': hits, 'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
@@ -0,0 +1,196 @@
+"""声明式交易规则
+
+规则写成表达式字符串，例如::
+
+    cross_above(ma5, ma10) & (close > bb_mid) & (volume > vol_ma5 * volume_ratio)
+
+编译后对整段数组(时间,)或面板(时间, 标的数)一次性求值，返回同形状的布尔掩码。
+同一条规则同时用于筛选器(取最后一根bar)、批量回测(整段掩码)和实盘(最近两根bar)。
+
+支持: 列名/参数名、数字、+ - * /、比较运算、& | ~ (以及and/or/not)、
+cross_above(a, b)、cross_below(a, b)、prev(x)。
+"""
+import ast
+import operator
+
+import numpy as np
+
+import indicators
+
+_BINOPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+}
+_CMPOPS = {
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+}
+
+
+def prev(x):
+    """沿时间轴后移一根bar，第一根bar没有前值(数值为NaN，布尔为False)"""
+    x = np.asarray(x)
+    if x.ndim == 0:
+        raise ValueError("prev() 需要数组输入")
+    fill = False if x.dtype == bool else np.nan
+    out = np.empty(x.shape, dtype=bool if x.dtype == bool else np.float64)
+    out[:1] = fill
+    out[1:] = x[:-1]
+    return out
+
+
+def cross_above(a, b):
+    """a当前在b之上且前一根bar不在b之上"""
+    a, b = _as_series(a, b)
+    return (a > b) & (prev(a) <= prev(b))
+
+
+def cross_below(a, b):
+    """a当前在b之下且前一根bar不在b之下"""
+    a, b = _as_series(a, b)
+    return (a < b) & (prev(a) >= prev(b))
+
+
+def _as_series(a, b):
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    return np.broadcast_arrays(a, b)
+
+
+_FUNCS = {'cross_above': cross_above, 'cross_below': cross_below, 'prev': prev}
+
+
+class Rule:
+    """编译后的规则，evaluate(frame, **params)返回布尔掩码"""
+
+    def __init__(self, expr):
+        self.expr = expr
+        tree = ast.parse(expr, mode='eval')
+        self.names = sorted({n.id for n in ast.walk(tree) if isinstance(n, ast.Name)} - set(_FUNCS))
+        self._fn = self._compile(tree.body)
+
+    def __repr__(self):
+        return f'Rule({self.expr!r})'
+
+    def evaluate(self, frame, **params):
+        env = {**params, **frame}
+        missing = [n for n in self.names if n not in env]
+        if missing:
+            raise KeyError(f"规则 {self.expr!r} 缺少输入: {missing}")
+        with np.errstate(invalid='ignore'):
+            return np.asarray(self._fn(env), dtype=bool)
+
+    def _compile(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            value = node.value
+            return lambda env: value
+        if isinstance(node, ast.Name):
+            name = node.id
+            return lambda env: env[name]
+        if isinstance(node, ast.UnaryOp):
+            operand = self._compile(node.operand)
+            if isinstance(node.op, (ast.Invert, ast.Not)):
+                return lambda env: ~np.asarray(operand(env), dtype=bool)
+            if isinstance(node.op, ast.USub):
+                return lambda env: -operand(env)
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+            op = _BINOPS[type(node.op)]
+            left, right = self._compile(node.left), self._compile(node.right)
+            return lambda env: op(left(env), right(env))
+        if isinstance(node, ast.BoolOp):
+            op = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+            values = [self._compile(v) for v in node.values]
+
+            def boolop(env):
+                result = np.asarray(values[0](env), dtype=bool)
+                for v in values[1:]:
+                    result = op(result, np.asarray(v(env), dtype=bool))
+                return result
+            return boolop
+        if isinstance(node, ast.Compare) and all(type(o) in _CMPOPS for o in node.ops):
+            operands = [self._compile(node.left)] + [self._compile(c) for c in node.comparators]
+            ops = [_CMPOPS[type(o)] for o in node.ops]
+
+            def compare(env):
+                values = [f(env) for f in operands]
+                result = ops[0](values[0], values[1])
+                for i in range(1, len(ops)):
+                    result = result & ops[i](values[i], values[i + 1])
+                return result
+            return compare
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCS:
+            func = _FUNCS[node.func.id]
+            args = [self._compile(a) for a in node.args]
+            return lambda env: func(*(a(env) for a in args))
+        raise ValueError(f"规则中不支持的语法: {ast.unparse(node)}")
+
+
+# MultiIndicatorStrategy / MLStrategy 的入场和离场条件
+ENTRY = Rule("cross_above(ma5, ma10) & cross_above(cci, -100)"
+             " & (close > bb_mid) & (volume > vol_ma5 * volume_ratio)")
+EXIT = Rule("cross_below(ma5, ma10) | cross_below(cci, 100) | (close < bb_bot)")
+# 止损依赖入场价，批量回测由simulate处理，实盘把stop_price作为输入
+STOP = Rule("close <= stop_price")
+# ETF筛选条件：当日金叉；SCREEN_TREND只要求短均线在长均线之上
+SCREEN = Rule("cross_above(ma5, ma10) & (cci > -100)"
+              " & (close > bb_mid) & (volume > vol_ma5 * volume_ratio)")
+SCREEN_TREND = Rule("(ma5 > ma10) & (cci > -100)"
+                    " & (close > bb_mid) & (volume > vol_ma5 * volume_ratio)")
+
+DEFAULT_PARAMS = {'volume_ratio': 1.5, 'stop_loss': 0.05}
+
+
+def indicator_frame(high, low, close, volume, ma_period1=5, ma_period2=10,
+                    cci_period=14, bb_period=20, bb_dev=2):
+    """计算规则用到的全部指标列，输入为(时间,)或(时间, 标的数)数组"""
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    bb_mid, bb_top, bb_bot = indicators.bollinger(close, bb_period, bb_dev)
+    return {
+        'close': close,
+        'volume': volume,
+        'ma5': indicators.sma(close, ma_period1),
+        'ma10': indicators.sma(close, ma_period2),
+        'cci': indicators.cci(high, low, close, cci_period),
+        'bb_mid': bb_mid,
+        'bb_bot': bb_bot,
+        'vol_ma5': indicators.volume_ma(volume, 5),
+    }
+
+
+def simulate(entry, exit, close, stop_loss=DEFAULT_PARAMS['stop_loss']):
+    """按入场/离场掩码和止损逐bar推进持仓状态，返回每根bar收盘后的持仓掩码
+
+    循环只沿时间轴进行，每一步对全部标的做向量运算。
+    """
+    entry, exit = np.asarray(entry, dtype=bool), np.asarray(exit, dtype=bool)
+    close = np.asarray(close, dtype=np.float64)
+    held = np.zeros(close.shape[1:], dtype=bool)
+    stop = np.full(close.shape[1:], np.nan)
+    positions = np.empty(close.shape, dtype=bool)
+    for t in range(close.shape[0]):
+        leave = held & (exit[t] | (close[t] <= stop))
+        enter = ~held & entry[t]
+        held = (held & ~leave) | enter
+        stop = np.where(enter, close[t] * (1 - stop_loss), np.where(leave, np.nan, stop))
+        positions[t] = held
+    return positions
+
+
+def backtest(frame, params=None, commission=0.0003, entry=ENTRY, exit=EXIT):
+    """用规则掩码做向量化回测，返回每根bar的净值(初始为1)，可直接交给performance.compute_metrics"""
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    close = frame['close']
+    positions = simulate(entry.evaluate(frame, **params), exit.evaluate(frame, **params),
+                         close, params['stop_loss'])
+    # 收盘出信号、下一根bar持有
+    held = prev(positions)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rets = np.nan_to_num(close / prev(close) - 1)
+    trades = np.abs(np.diff(held.astype(np.int8), axis=0, prepend=0))
+    return np.cumprod(1 + held * rets - trades * commission, axis=0)
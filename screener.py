@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+import http_pool
+import rules
+from trade_calendar import WARMUP_BARS, fetch_range
+
+# 快照预筛选的默认阈值：成交额(元)、成交量(股)、涨跌幅(%)
+# 只含rules.SCREEN的必要条件：放量要求当日成交量大于0，其余条件都可能在下跌或成交额小时成立
+DEFAULT_PREFILTER = {
+    'min_amount': None,
+    'min_volume': 1,
+    'min_change': None,
+    'max_change': None,
+}
+# 更激进的剪枝，需要显式传入：金叉、站上中轨和放量通常伴随当日上涨和足够的成交，
+# 但不是必要条件，会漏掉当日下跌或成交额低于阈值却满足SCREEN的ETF
+LOSSY_PREFILTER = {
+    'min_amount': 1e7,
+    'min_change': 0.0,
+}
+
+
+def prefilter(df_spot, min_amount=None, min_volume=None, min_change=None, max_change=None):
+    """在全市场快照上做廉价筛选，只把可能满足条件的ETF交给后续的历史数据请求
+
+    DEFAULT_PREFILTER只剔除不可能满足rules.SCREEN的标的，结果与全量扫描一致；
+    传入LOSSY_PREFILTER中的成交额、涨跌幅阈值可以进一步减少请求，但可能漏掉满足条件的ETF。
+    """
+    mask = df_spot['名称'].str.contains('ETF')
+    if min_amount:
+        mask &= df_spot['成交额'] >= min_amount
+    if min_volume:
+        mask &= df_spot['成交量'] >= min_volume
+    if min_change is not None:
+        mask &= df_spot['涨跌幅'] >= min_change
+    if max_change is not None:
+        mask &= df_spot['涨跌幅'] <= max_change
+    # 快照代码带交易所前缀(如sh510300)，历史行情接口只要6位代码
+    return df_spot.loc[mask, '代码'].astype(str).str[-6:].tolist()
+
+
+def fetch_history(symbol, n=WARMUP_BARS):
+    """按交易日历只请求最近n个交易日的日线数据"""
+    import akshare as ak
+    start_date, end_date = fetch_range(n)
+    return ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start_date,
+                              end_date=end_date, adjust="qfq")
+
+
+def match_conditions(df_hist, volume_ratio=1.1):
+    """最后一根bar是否满足rules.SCREEN筛选条件"""
+    if df_hist is None or df_hist.empty or len(df_hist) < 5:
+        return False
+    frame = rules.indicator_frame(df_hist['最高'].values, df_hist['最低'].values,
+                                  df_hist['收盘'].values, df_hist['成交量'].values)
+    return bool(rules.SCREEN.evaluate(frame, volume_ratio=volume_ratio)[-1])
+
+
+async def screen_stream(symbols, fetch=fetch_history, condition=match_conditions,
+                        n_fetchers=8, n_workers=2, queue_size=16):
+    """获取->计算两级流水线，满足条件的代码一经确认立即产出
+
+    获取协程把阻塞的行情请求放进线程池；获取结果进入有界队列，
+    计算跟不上时获取协程在put处等待(背压)，内存中最多只有queue_size份历史数据。
+    """
+    pending = asyncio.Queue()
+    for symbol in symbols:
+        pending.put_nowait(symbol)
+    fetched = asyncio.Queue(maxsize=queue_size)
+    matches = asyncio.Queue()
+    done = object()
+
+    async def fetcher():
+        while True:
+            try:
+                symbol = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                df = await asyncio.to_thread(fetch, symbol)
+            except Exception as e:
+                print(f"{symbol} 数据获取失败:", e)
+                continue
+            await fetched.put((symbol, df))
+
+    async def worker():
+        while True:
+            item = await fetched.get()
+            if item is done:
+                return
+            symbol, df = item
+            try:
+                ok = condition(df)
+            except Exception as e:
+                print(f"{symbol} 指标计算失败:", e)
+                continue
+            if ok:
+                await matches.put(symbol)
+
+    fetchers = [asyncio.create_task(fetcher()) for _ in range(n_fetchers)]
+    workers = [asyncio.create_task(worker()) for _ in range(n_workers)]
+
+    async def close():
+        await asyncio.gather(*fetchers)
+        for _ in workers:
+            await fetched.put(done)
+        await asyncio.gather(*workers)
+        await matches.put(done)
+
+    closer = asyncio.create_task(close())
+    try:
+        while True:
+            symbol = await matches.get()
+            if symbol is done:
+                break
+            yield symbol
+    finally:
+        # 调用方提前退出时取消全部协程
+        for task in [closer, *fetchers, *workers]:
+            task.cancel()
+
+
+async def get_realtime_spot(**prefilter_kwargs):
+    """获取实时行情，预筛选后流式筛选ETF，prefilter_kwargs覆盖DEFAULT_PREFILTER(如**LOSSY_PREFILTER)"""
+    import akshare as ak
+    start = time.perf_counter()
+    df_spot = ak.stock_zh_a_spot()
+    etfs = df_spot['名称'].str.contains('ETF').sum()
+    candidates = prefilter(df_spot, **{**DEFAULT_PREFILTER, **prefilter_kwargs})
+    print(f"实时行情数据获取成功，总数：{len(df_spot)}，ETF {etfs} 只，预筛选后剩余 {len(candidates)} 只")
+
+    selected_etfs = []
+    async for symbol in screen_stream(candidates):
+        selected_etfs.append(symbol)
+        print(f"{symbol} 满足条件！({time.perf_counter() - start:.1f}s)")
+
+    print("满足条件的ETF股票代码：", selected_etfs)
+    print(f"筛选耗时 {time.perf_counter() - start:.1f}s")
+    return selected_etfs
+
+
+if __name__ == '__main__':
+    http_pool.install()
+    asyncio.run(get_realtime_spot())
+    http_pool.print_stats()
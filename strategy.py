@@ -1,14 +1,178 @@
+from array import array
+
 import backtrader as bt
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-import xgboost as xgb
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score
-import talib as ta
-import akshare as ak
-
-class MLStrategy(bt.Strategy):
+import indicators
+import rules
+import telemetry
+from array_feed import ArrayData
+from performance import EquityRecorder, compute_metrics, print_metrics
+
+class BatchIndicator(bt.Indicator):
+    """用indicators模块计算的backtrader指标，与训练特征(add_features)和实盘引擎使用同一套实现
+
+    预加载(runonce)时对整段数据调用一次批量函数写入数据线，逐bar运行时用对应的流式版本更新，
+    两种方式结果逐位一致。子类给出inputs/compute/streaming/update。
+    """
+
+    def __init__(self):
+        self.addminperiod(self.p.period)
+        self._stream = self.streaming()
+
+    def _write(self, i, values):
+        for line, v in zip(self.lines, values):
+            line[i] = v
+
+    def prenext(self):
+        # 预热期也要更新流式状态
+        self.next()
+
+    def next(self):
+        self._write(0, self.update(*[line[0] for line in self.inputs()]))
+
+    def preonce(self, start, end):
+        n = self.buflen()
+        arrays = [np.array(line.array[:n], dtype=np.float64) for line in self.inputs()]
+        self._batch = self.compute(*arrays)
+
+    def once(self, start, end):
+        for line, values in zip(self.lines, self._batch):
+            line.array[start:end] = array('d', values[start:end].tobytes())
+
+
+class SMA(BatchIndicator):
+    lines = ('sma',)
+    params = (('period', 5),)
+
+    def inputs(self):
+        return [self.data.lines[0]]
+
+    def compute(self, x):
+        return (indicators.sma(x, self.p.period),)
+
+    def streaming(self):
+        return indicators.StreamingSMA(self.p.period)
+
+    def update(self, x):
+        return (self._stream.update(x),)
+
+
+class BollingerBands(BatchIndicator):
+    lines = ('mid', 'top', 'bot')
+    params = (('period', 20), ('devfactor', 2))
+
+    def inputs(self):
+        return [self.data.lines[0]]
+
+    def compute(self, x):
+        return indicators.bollinger(x, self.p.period, self.p.devfactor)
+
+    def streaming(self):
+        return indicators.StreamingBollinger(self.p.period, self.p.devfactor)
+
+    def update(self, x):
+        return self._stream.update(x)
+
+
+class CCI(BatchIndicator):
+    """标准定义的CCI，输入为数据源(用高、低、收)"""
+    lines = ('cci',)
+    params = (('period', 14),)
+
+    def inputs(self):
+        return [self.data.high, self.data.low, self.data.close]
+
+    def compute(self, high, low, close):
+        return (indicators.cci(high, low, close, self.p.period),)
+
+    def streaming(self):
+        return indicators.StreamingCCI(self.p.period)
+
+    def update(self, high, low, close):
+        return (self._stream.update(high, low, close),)
+
+
+class RuleSignalsMixin:
+    """在策略的指标线上按rules.ENTRY/EXIT/STOP判断进出场，与实盘引擎(live_engine.SymbolState)用同一套规则
+
+    规则输入为各指标最近两根bar，结果取最后一根。
+    """
+
+    def rule_frame(self):
+        lines = {
+            'close': self.data.close,
+            'volume': self.data.volume,
+            'ma5': self.ma5,
+            'ma10': self.ma10,
+            'cci': self.cci,
+            'bb_mid': self.bb.mid,
+            'bb_bot': self.bb.bot,
+            'vol_ma5': self.vol_ma5,
+        }
+        return {k: np.array([line[-1], line[0]]) for k, line in lines.items()}
+
+    def entry_signal(self, frame):
+        return bool(rules.ENTRY.evaluate(frame, volume_ratio=self.p.volume_ratio)[-1])
+
+    def exit_signal(self, frame):
+        return bool(rules.EXIT.evaluate(frame)[-1]
+                    or rules.STOP.evaluate(frame, stop_price=self.stop_price)[-1])
+
+
+class MultiIndicatorStrategy(RuleSignalsMixin, bt.Strategy):
+    params = (
+        ('ma_period1', 5),
+        ('ma_period2', 10),
+        ('cci_period', 14),
+        ('bb_period', 20),
+        ('bb_dev', 2),
+        ('volume_ratio', 1.5),
+        ('stop_loss', 0.05),
+    )
+
+    def __init__(self):
+        # 计算指标
+        self.ma5 = SMA(self.data.close, period=self.p.ma_period1)
+        self.ma10 = SMA(self.data.close, period=self.p.ma_period2)
+        self.cci = CCI(self.data, period=self.p.cci_period)
+        
+        # 布林带
+        self.bb = BollingerBands(self.data.close,
+                                 period=self.p.bb_period,
+                                 devfactor=self.p.bb_dev)
+        # 成交量均线
+        self.vol_ma5 = SMA(self.data.volume, period=5)
+        
+        # 跟踪订单和持仓状态
+        self.order = None
+        self.stop_price = None
+
+    def next(self):
+        if self.order:  # 有未完成订单则跳过
+            return
+        
+        frame = self.rule_frame()
+        # 入场条件（多头）：均线金叉、CCI从<-100回升、价格突破布林带中轨、成交量放量
+        if self.entry_signal(frame):
+            # 计算头寸（假设使用总资金的90%）
+            size = self.broker.getcash() * 0.9 / self.data.close[0]
+            self.order = self.buy(size=size)
+            # 设置止损（5%止损）
+            self.stop_price = self.data.close[0] * (1 - self.p.stop_loss)
+        
+        # 离场条件：均线死叉、CCI从>100回落、价格跌破布林带下轨或触发止损
+        elif self.position:
+            if self.exit_signal(frame):
+                self.order = self.sell(size=self.position.size)
+                self.stop_price = None  # 重置止损
+
+    def notify_order(self, order):
+        if order.status in [order.Completed]:
+            self.order = None
+
+
+class MLStrategy(RuleSignalsMixin, bt.Strategy):
     params = (
         ('ma_period1', 5),
         ('ma_period2', 10),
@@ -18,18 +182,25 @@ class MLStrategy(bt.Strategy):
         ('volume_ratio', 1.5),
         ('stop_loss', 0.05),
         ('rf_model', None),
-        ('xgb_model', None)
+        ('xgb_model', None),
+        ('entry_prob', 0.7),  # 两个模型平均上涨概率高于该值才入场
+        ('exit_prob', 0.3),  # 低于该值离场
+        ('pred_cache', None),  # pred_cache.PredictionCache，按数据源名称缓存预测概率
+        ('risk', None),  # risk.RiskEngine，按波动率和目标波动率限制仓位，None时用9成现金买入
+        ('online', None),  # online.OnlineLearner，逐bar收集样本并增量更新XGBoost
     )
+    # 特征的指标来源及实现版本，不同来源的预测分开缓存
+    feature_source = f'indicators-v{indicators.VERSION}'
 
     def __init__(self):
         # 技术指标
-        self.ma5 = bt.indicators.SMA(self.data.close, period=self.p.ma_period1)
-        self.ma10 = bt.indicators.SMA(self.data.close, period=self.p.ma_period2)
-        self.cci = bt.indicators.CCI(self.data, period=self.p.cci_period)
-        self.bb = bt.indicators.BollingerBands(self.data.close, 
-                                             period=self.p.bb_period,
-                                             devfactor=self.p.bb_dev)
-        self.vol_ma5 = bt.indicators.SMA(self.data.volume, period=5)
+        self.ma5 = SMA(self.data.close, period=self.p.ma_period1)
+        self.ma10 = SMA(self.data.close, period=self.p.ma_period2)
+        self.cci = CCI(self.data, period=self.p.cci_period)
+        self.bb = BollingerBands(self.data.close,
+                                 period=self.p.bb_period,
+                                 devfactor=self.p.bb_dev)
+        self.vol_ma5 = SMA(self.data.volume, period=5)
         
         self.order = None
         self.stop_price = None
@@ -49,44 +220,82 @@ class MLStrategy(bt.Strategy):
             (self.data.close[0] - self.data.open[0]) / self.data.open[0]  # 涨跌幅
         ]).reshape(1, -1)
 
+    def start(self):
+        self._predictions = None
+        if self.p.pred_cache is not None and self.p.online is not None:
+            raise ValueError("在线更新时模型不断变化，不能使用pred_cache")
+        if self.p.pred_cache is not None:
+            if not self.data._name:
+                raise ValueError("使用pred_cache时数据源需要设置name(标的代码)")
+            # 特征依赖指标实现和周期，来源或周期不同的预测分开缓存
+            spec = (f'{self.feature_source}_ma{self.p.ma_period1}-{self.p.ma_period2}'
+                    f'_cci{self.p.cci_period}_bb{self.p.bb_period}-{self.p.bb_dev}')
+            self._predictions = self.p.pred_cache.series(self.data._name, spec)
+        self._risk_datas = None
+        if self.p.risk is not None:
+            # 引擎的标的池按名称对应到数据源
+            self._risk_datas = [self.getdatabyname(s) for s in self.p.risk.symbols]
+
+    def predict(self):
+        """返回当前bar的(随机森林, XGBoost)上涨概率，有缓存时优先读缓存"""
+        if self._predictions is not None:
+            ts = self.data.datetime[0]
+            cached = self._predictions.get(ts)
+            if cached is not None:
+                return cached
+        features = self.get_features()
+        rf_pred = self.rf_model.predict_proba(features)[0][1]
+        xgb_pred = self.xgb_model.predict_proba(features)[0][1]
+        if self._predictions is not None:
+            self._predictions.put(ts, float(rf_pred), float(xgb_pred))
+        return rf_pred, xgb_pred
+
+    def order_size(self):
+        """入场股数，有风险引擎时按目标权重分配，且不超过可用现金
+
+        策略只交易self.data，入场时没有其他持仓，目标权重只受该标的自身波动率、max_weight
+        和target_vol限制；多个持仓之间按相关性分配见panel.PanelStrategy。
+        """
+        price = self.data.close[0]
+        size = self.broker.getcash() * 0.9 / price
+        if self.p.risk is not None:
+            size = min(size, self.p.risk.size(self.data._name, [], self.broker.getvalue(), price))
+        return size
+
+    def stop(self):
+        if self._predictions is not None:
+            self._predictions.flush()
+
     def next(self):
+        if self.p.risk is not None:
+            self.p.risk.update([d.close[0] for d in self._risk_datas], self.data.datetime[0])
+        if self.p.online is not None:
+            self.p.online.observe(self.data._name, self.get_features()[0], self.data.close[0])
+            # 更新完成后从这根bar起使用新模型
+            self.rf_model, self.xgb_model = self.p.online.models
         if self.order:
             return
             
-        # 获取当前特征
-        features = self.get_features()
-        
         # 使用机器学习模型预测
-        rf_pred = self.rf_model.predict_proba(features)[0][1]
-        xgb_pred = self.xgb_model.predict_proba(features)[0][1]
+        rf_pred, xgb_pred = self.predict()
         
         # 综合预测概率
-        ml_signal = (rf_pred + xgb_pred) / 2 > 0.7  # 设置较高的阈值
+        ml_signal = (rf_pred + xgb_pred) / 2 > self.p.entry_prob  # 设置较高的阈值
         
-        # 技术指标信号
-        ma_cross = (self.ma5[0] > self.ma10[0]) and (self.ma5[-1] <= self.ma10[-1])
-        cci_signal = (self.cci[0] > -100) and (self.cci[-1] <= -100)
-        price_above_bbmid = self.data.close[0] > self.bb.mid[0]
-        volume_spike = self.data.volume[0] > self.vol_ma5[0] * self.p.volume_ratio
+        frame = self.rule_frame()
         
         # 入场条件:技术指标 + 机器学习确认
         if not self.position:
-            if ma_cross and cci_signal and price_above_bbmid and volume_spike and ml_signal:
-                size = self.broker.getcash() * 0.9 / self.data.close[0]
-                self.order = self.buy(size=size)
+            if ml_signal and self.entry_signal(frame):
+                self.order = self.buy(size=self.order_size())
                 self.stop_price = self.data.close[0] * (1 - self.p.stop_loss)
         
         # 离场条件
         elif self.position:
-            ma_death = (self.ma5[0] < self.ma10[0]) and (self.ma5[-1] >= self.ma10[-1])
-            cci_exit = (self.cci[0] < 100) and (self.cci[-1] >= 100)
-            price_below_bblower = self.data.close[0] < self.bb.bot[0]
-            stop_trigger = self.data.close[0] <= self.stop_price
-            
             # 机器学习模型预测下跌概率高
-            ml_exit = (rf_pred + xgb_pred) / 2 < 0.3
+            ml_exit = (rf_pred + xgb_pred) / 2 < self.p.exit_prob
             
-            if ma_death or cci_exit or price_below_bblower or stop_trigger or ml_exit:
+            if ml_exit or self.exit_signal(frame):
                 self.order = self.sell(size=self.position.size)
                 self.stop_price = None
 
@@ -98,8 +307,62 @@ class MLStrategy(bt.Strategy):
                 print(f'卖出执行价格: {order.executed.price:.2f}')
             self.order = None
 
+# 模型输入特征，与MLStrategy.get_features的计算口径一致
+FEATURES = ['ma5/ma10', 'cci', 'bb_pos', 'vol_ratio', 'amplitude', 'return']
+# 标签观察未来5根bar的收益
+LABEL_HORIZON = 5
+
+def add_features(df, labels=True):
+    """计算技术指标特征，labels=True时同时生成标签"""
+    # 计算技术指标作为特征
+    df['ma5'] = indicators.sma(df['close'].values, 5)
+    df['ma10'] = indicators.sma(df['close'].values, 10)
+    df['ma5/ma10'] = df['ma5'] / df['ma10'] - 1
+    df['cci'] = indicators.cci(df['high'].values, df['low'].values, df['close'].values, 14)
+    middle, upper, lower = indicators.bollinger(df['close'].values, 20, 2)
+    df['bb_pos'] = (df['close'] - middle) / middle
+    df['vol_ratio'] = df['volume'] / indicators.volume_ma(df['volume'].values, 5) - 1
+    df['amplitude'] = (df['high'] - df['low']) / df['low']
+    df['return'] = (df['close'] - df['open']) / df['open']
+    
+    if labels:
+        add_labels(df)
+    
+    return df
+
+def add_labels(df, horizon=LABEL_HORIZON, threshold=0.001):
+    """生成标签：未来horizon根bar的收益超过threshold记为1"""
+    df['target'] = (df['close'].shift(-horizon) / df['close'] - 1 > threshold).astype(int)
+    return df
+
+def select_dates(df, start_date, end_date):
+    """start_date到end_date(含这一整天)之间的bar，prepare_data和pipeline使用同样的区间边界"""
+    start = pd.Timestamp(start_date).normalize()
+    end = pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)
+    return df[(df.index >= start) & (df.index < end)]
+
 def prepare_data(code, start_date, end_date):
     """准备分钟级数据并计算特征"""
+    with telemetry.stage('fetch', code):
+        df = fetch_minute_bars(code)
+    if df.empty:
+        return df
+    
+    # 筛选时间范围
+    df = select_dates(df, start_date, end_date)
+    
+    # 如果成功获取数据，计算技术指标
+    if not df.empty:
+        with telemetry.stage('features', code):
+            return add_features(df)
+        
+    return pd.DataFrame()
+
+def fetch_minute_bars(code):
+    """获取数据源能提供的全部1分钟数据(前复权)，失败时返回空表"""
+    # akshare导入较慢，只在真正取数时导入
+    import akshare as ak
+
     # 转换股票代码格式（去掉.SZ/.SH后缀）
     symbol = code.split('.')[0]
     
@@ -132,29 +395,7 @@ def prepare_data(code, start_date, end_date):
             
             # 将时间列转换为datetime格式
             df['trade_time'] = pd.to_datetime(df['trade_time'])
-            df = df.set_index('trade_time')
-            
-            # 筛选时间范围
-            df = df[(df.index >= start_date) & (df.index <= end_date)]
-            
-            # 如果成功获取数据，计算技术指标
-            if not df.empty:
-                # 计算技术指标作为特征
-                df['ma5'] = ta.SMA(df['close'].values, timeperiod=5)
-                df['ma10'] = ta.SMA(df['close'].values, timeperiod=10)
-                df['cci'] = ta.CCI(df['high'].values, df['low'].values, df['close'].values, timeperiod=14)
-                upper, middle, lower = ta.BBANDS(df['close'].values, timeperiod=20)
-                df['bb_pos'] = (df['close'] - middle) / middle
-                df['vol_ratio'] = df['volume'] / ta.SMA(df['volume'].values, timeperiod=5)
-                df['amplitude'] = (df['high'] - df['low']) / df['low']
-                df['return'] = df['close'].pct_change()
-                
-                # 生成标签
-                df['target'] = (df['close'].shift(-5) / df['close'] - 1 > 0.001).astype(int)
-                
-                return df
-                
-            return pd.DataFrame()
+            return df.set_index('trade_time')
             
         except Exception as e:
             print(f"Attempt {retry_count + 1} failed for {code}: {str(e)}")
@@ -167,71 +408,205 @@ def prepare_data(code, start_date, end_date):
     print(f"Failed to retrieve data for {code} after {max_retries} attempts")
     return pd.DataFrame()
 
-def train_models(train_data):
-    """训练机器学习模型"""
-    features = ['ma5/ma10', 'cci', 'bb_pos', 'vol_ratio', 'amplitude', 'return']
-    X = train_data[features]
+def train_models(train_data, rf_params=None, xgb_params=None):
+    """训练机器学习模型，未指定参数时使用默认参数"""
+    from sklearn.ensemble import RandomForestClassifier
+    import xgboost as xgb
+
+    X = train_data[FEATURES]
     y = train_data['target']
     
     # 随机森林
-    rf_model = RandomForestClassifier(n_estimators=100, max_depth=5)
-    rf_model.fit(X, y)
+    rf_model = RandomForestClassifier(**(rf_params or {'n_estimators': 100, 'max_depth': 5}))
+    with telemetry.stage('fit_rf'):
+        rf_model.fit(X, y)
     
     # XGBoost
-    xgb_model = xgb.XGBClassifier(max_depth=5, learning_rate=0.1)
-    xgb_model.fit(X, y)
+    xgb_model = xgb.XGBClassifier(**(xgb_params or {'max_depth': 5, 'learning_rate': 0.1}))
+    with telemetry.stage('fit_xgb'):
+        xgb_model.fit(X, y)
     
     return rf_model, xgb_model
 
+@telemetry.instrument('run_strategy')
 def run_strategy(codes=['159920.SZ', '513050.SH'], # QDII ETF示例
                 train_start='20130101',
                 train_end='20151231',
                 valid_start='20160101',
                 valid_end='20191231',
-                cash=1000000.0):
-    """运行策略"""
+                cash=1000000.0,
+                dataset_dir=None,
+                tune=False,
+                talib_lines=False,
+                plot='static',
+                plot_path='backtest.png',
+                pred_cache=False,
+                risk_sizing=False,
+                checkpoint=None,
+                panel=False,
+                online_updates=False):
+    """运行策略
+
+    指定dataset_dir时训练数据逐个标的写入磁盘数据集并以外存方式训练，
+    训练集大小不再受内存限制；同时指定tune=True时先在该数据集上做参数搜索。
+    talib_lines=True时回测使用TA-Lib预计算的指标线，策略不再逐bar计算指标。
+    plot='static'时把降采样后的结果图写入plot_path，'interactive'使用cerebro.plot()，None不绘图。
+    pred_cache=True时模型预测概率持久化缓存，模型不变时重复回测不再推理。
+    risk_sizing=True时按各标的收益的滚动协方差分配入场仓位(见risk.RiskEngine)，
+    与panel=True同用时同时持有的标的相关性越高仓位越小；MLStrategy只交易第一个标的，只按波动率限制仓位。
+    checkpoint为检查点文件路径，回测中定期写入；文件已存在时使用其中的模型(及风险引擎)，从中断处继续回测。
+    panel=True时全部标的对齐成一个面板数据源同时交易(见panel)，标的多时每bar开销明显更低，不绘图。
+    online_updates=True时回测中逐bar收集样本，每满240行新样本增量训练一次XGBoost(见online)，
+    从检查点恢复时沿用检查点中已更新的模型。
+    telemetry_path给出时记录各阶段的耗时和内存，结束时写出报告和调用栈采样，
+    telemetry_malloc=True时同时统计内存分配(见telemetry)。
+    """
+    if tune and not dataset_dir:
+        raise ValueError("tune=True requires dataset_dir")
+    resume = None
+    if checkpoint:
+        from checkpoint import load
+        resume = load(checkpoint)
     
     # 训练模型
-    train_dfs = []
-    valid_codes = []
-    
-    for code in codes:
-        df = prepare_data(code, train_start, train_end)
-        if not df.empty:
-            train_dfs.append(df)
-            valid_codes.append(code)
-    
-    if not train_dfs:
-        raise ValueError("No valid data available for any of the provided codes")
-    
-    train_data = pd.concat(train_dfs)
-    
-    rf_model, xgb_model = train_models(train_data)
+    learner = None
+    if resume is not None:
+        rf_model, xgb_model = resume['extra']['models']
+        if online_updates and resume['extra'].get('online') is not None:
+            learner = resume['extra']['online']
+            rf_model, xgb_model = learner.models
+    elif dataset_dir:
+        from dataset import build_dataset, train_models_from_dataset
+        with telemetry.stage('dataset'):
+            dataset = build_dataset(codes, train_start, train_end, dataset_dir)
+        if not len(dataset):
+            raise ValueError("No valid data available for any of the provided codes")
+        if tune:
+            from hyperopt import search
+            with telemetry.stage('tune'):
+                best = search(dataset.path)
+            rf_model, xgb_model = best['rf_model'], best['xgb_model']
+        else:
+            with telemetry.stage('train'):
+                rf_model, xgb_model = train_models_from_dataset(dataset)
+    else:
+        train_dfs = []
+        valid_codes = []
+        
+        for code in codes:
+            df = prepare_data(code, train_start, train_end)
+            if not df.empty:
+                train_dfs.append(df)
+                valid_codes.append(code)
+        
+        if not train_dfs:
+            raise ValueError("No valid data available for any of the provided codes")
+        
+        with telemetry.stage('concat'):
+            train_data = pd.concat(train_dfs)
+        
+        with telemetry.stage('train'):
+            rf_model, xgb_model = train_models(train_data)
     
     # 回测
-    cerebro = bt.Cerebro()
+    datas = [prepare_data(code, valid_start, valid_end) for code in codes]
+    strategy_params = {}
+    if pred_cache:
+        from pred_cache import PredictionCache
+        strategy_params['pred_cache'] = PredictionCache.for_models(rf_model, xgb_model)
+    if risk_sizing:
+        from risk import RiskEngine
+        # 从检查点恢复时沿用快照中的引擎，预热bar不再更新它
+        risk = resume['extra'].get('risk') if resume is not None else None
+        strategy_params['risk'] = risk or RiskEngine(codes)
+    if online_updates:
+        from online import OnlineLearner
+        # 回测中同步更新，结果可以复现；实盘用background=True
+        strategy_params['online'] = learner or OnlineLearner(rf_model, xgb_model, background=False)
+    strat, metrics = run_backtest(datas, rf_model, xgb_model, cash=cash, talib_lines=talib_lines,
+                                  names=codes, checkpoint=checkpoint, resume=resume, panel=panel,
+                                  **strategy_params)
+    print_metrics(metrics)
     
-    for code in codes:
-        # 获取验证期数据
-        data = prepare_data(code, valid_start, valid_end)
-        feed = bt.feeds.PandasData(dataname=data)
+    if panel:
+        plot = None  # 面板数据源只有时间线，没有可画的价格
+    if plot == 'static':
+        from plotting import plot_backtest
+        with telemetry.stage('plot'):
+            plot_backtest(strat, plot_path)
+    elif plot == 'interactive':
+        strat.env.plot()
+
+def run_backtest(datas, rf_model, xgb_model, cash=1000000.0, talib_lines=False, names=None,
+                 checkpoint=None, resume=None, panel=False, **strategy_params):
+    """用训练好的模型在验证期数据上回测，返回(策略实例, 绩效指标)
+
+    names为各数据源的标的代码(使用预测缓存或检查点时必需)，
+    checkpoint为检查点文件路径，resume为checkpoint.load()读出的快照，给出时从快照处继续，
+    panel=True时全部标的对齐成一个面板数据源，由PanelMLStrategy同时交易所有标的(见panel)，
+    strategy_params覆盖MLStrategy的参数，如volume_ratio、stop_loss、pred_cache、risk、online。
+    """
+    cerebro = bt.Cerebro()
+    if panel:
+        if talib_lines or checkpoint or resume is not None \
+                or strategy_params.get('pred_cache') or strategy_params.get('online'):
+            raise ValueError("面板回测不支持talib_lines、检查点、预测缓存和在线更新")
+        from panel import Panel, PanelData, PanelMLStrategy
+        with telemetry.stage('panel'):
+            feed = PanelData(panel=Panel.from_frames(datas, names), name='panel')
         cerebro.adddata(feed)
+        strategy_params = {k: v for k, v in strategy_params.items()
+                           if k not in ('pred_cache', 'online')}
+        return _run_cerebro(cerebro, PanelMLStrategy, rf_model, xgb_model, cash, strategy_params)
+
+    strategy_cls = MLStrategy
+    if talib_lines:
+        from talib_feed import TALibData, FastMLStrategy, add_indicator_lines
+        strategy_cls = FastMLStrategy
+    if checkpoint or resume is not None:
+        from checkpoint import Checkpointer, resume_data, with_checkpoint
+        strategy_cls = with_checkpoint(strategy_cls)
+        # 在线更新的模型随learner一起保存，风险引擎的协方差窗口无法靠预热bar重建，也一起保存
+        cerebro.addanalyzer(Checkpointer, _name='checkpoint', path=checkpoint, resume=resume,
+                            extra={'models': (rf_model, xgb_model),
+                                   'online': strategy_params.get('online'),
+                                   'risk': strategy_params.get('risk')})
     
+    for data, name in zip(datas, names or [None] * len(datas)):
+        if resume is not None:
+            data = resume_data(resume, name, data)
+        if talib_lines:
+            with telemetry.stage('talib_lines', name):
+                feed = TALibData(dataname=add_indicator_lines(data), name=name)
+        else:
+            feed = ArrayData(dataname=data, name=name)
+        if telemetry.active():
+            # 数据在cerebro.run()开始时预加载，单独计时
+            feed.preload = telemetry.wrap(feed.preload, 'preload', name)
+        cerebro.adddata(feed)
+    return _run_cerebro(cerebro, strategy_cls, rf_model, xgb_model, cash, strategy_params)
+
+def _run_cerebro(cerebro, strategy_cls, rf_model, xgb_model, cash, strategy_params):
     # 添加策略
-    cerebro.addstrategy(MLStrategy, 
+    cerebro.addstrategy(strategy_cls, 
                         rf_model=rf_model,
-                        xgb_model=xgb_model)
+                        xgb_model=xgb_model,
+                        **strategy_params)
     
     cerebro.broker.setcash(cash)
     cerebro.broker.setcommission(commission=0.0003)  # 设置较低的手续费
+    # 只记录净值数组，绩效指标在回测结束后向量化计算
+    cerebro.addanalyzer(EquityRecorder, _name='equity')
     
     print(f'初始资金: {cerebro.broker.getvalue():.2f}')
-    cerebro.run()
+    with telemetry.stage('backtest'):
+        strat = cerebro.run()[0]
     print(f'最终资金: {cerebro.broker.getvalue():.2f}')
-    
-    cerebro.plot()
+    return strat, compute_metrics(**strat.analyzers.equity.get_arrays())
 
 if __name__ == '__main__':
+    import http_pool
+    http_pool.install()
     run_strategy(
         codes=['000001.SZ', '600000.SH'],  # 平安银行和浦发银行
         train_start='20230801',  # 使用更近的时间
@@ -0,0 +1,72 @@
+import talib as ta
+
+from array_feed import ArrayData
+from strategy import MLStrategy, MultiIndicatorStrategy
+
+INDICATOR_LINES = ('ma5', 'ma10', 'cci', 'bb_mid', 'bb_bot', 'vol_ma5')
+
+
+def add_indicator_lines(df, ma_period1=5, ma_period2=10, cci_period=14, bb_period=20, bb_dev=2):
+    """用TA-Lib一次性计算策略所需的全部指标列，周期需与策略参数一致"""
+    df = df.copy()
+    close = df['close'].values.astype(float)
+    df['ma5'] = ta.SMA(close, timeperiod=ma_period1)
+    df['ma10'] = ta.SMA(close, timeperiod=ma_period2)
+    df['cci'] = ta.CCI(df['high'].values.astype(float), df['low'].values.astype(float), close,
+                       timeperiod=cci_period)
+    upper, middle, lower = ta.BBANDS(close, timeperiod=bb_period, nbdevup=bb_dev, nbdevdn=bb_dev)
+    df['bb_mid'] = middle
+    df['bb_bot'] = lower
+    df['vol_ma5'] = ta.SMA(df['volume'].values.astype(float), timeperiod=5)
+    return df
+
+
+class TALibData(ArrayData):
+    """带预计算指标线的数据源，指标列由add_indicator_lines生成，预加载时与OHLCV一起整列写入"""
+    lines = INDICATOR_LINES
+
+
+class _Bands:
+    """让策略继续用self.bb.mid / self.bb.bot访问布林带"""
+
+    def __init__(self, data):
+        self.mid = data.bb_mid
+        self.bot = data.bb_bot
+
+
+class PrecomputedIndicatorsMixin:
+    """用数据源上的预计算指标线代替策略中由indicators计算的指标
+
+    TA-Lib的均线、布林带和CCI与indicators同为标准定义，布林带相对误差约1e-9(见indicators)，其余更小。
+    """
+    feature_source = f'talib-{ta.__version__}'
+
+    def __init__(self):
+        self.ma5 = self.data.ma5
+        self.ma10 = self.data.ma10
+        self.cci = self.data.cci
+        self.bb = _Bands(self.data)
+        self.vol_ma5 = self.data.vol_ma5
+        # 与strategy.BatchIndicator指标相同的预热期
+        self._warmup = max(self.p.ma_period2, self.p.cci_period, self.p.bb_period)
+
+        self.order = None
+        self.stop_price = None
+
+    def next(self):
+        if len(self) < self._warmup:
+            return
+        super().next()
+
+
+class FastMultiIndicatorStrategy(PrecomputedIndicatorsMixin, MultiIndicatorStrategy):
+    pass
+
+
+class FastMLStrategy(PrecomputedIndicatorsMixin, MLStrategy):
+
+    def __init__(self):
+        super().__init__()
+        # 加载机器学习模型
+        self.rf_model = self.p.rf_model
+        self.xgb_model = self.p.xgb_model
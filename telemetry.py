@@ -0,0 +1,242 @@
+"""运行遥测：各阶段的耗时、CPU时间、内存和分配
+
+默认关闭，stage()在没有激活的记录器时什么也不做，埋点对正常运行没有开销。
+用instrument装饰的入口函数(run_strategy、pipeline.run)传入telemetry_path时启用：
+
+    run_strategy(..., telemetry_path='telemetry/run')
+    run_strategy(..., telemetry_path='telemetry/run', telemetry_malloc=True)  # 同时统计内存分配
+
+每个阶段(可嵌套，可带标的)记录墙钟时间、进程CPU时间、RSS的起点/峰值/增量，
+以及tracemalloc统计的Python内存分配净增量和峰值。运行结束时写入:
+- {path}.json  每个阶段一条记录，另有按阶段名汇总的结果；
+- {path}.folded  采样线程按sample_interval记录的调用栈，"栈;帧 次数"格式，
+  栈顶是阶段路径，可直接交给flamegraph.pl或speedscope生成火焰图。
+
+tracemalloc会让分配密集的代码明显变慢(逐bar推理的回测约慢4倍)，开启后耗时只能相对比较，
+所以入口函数默认不开启；调用栈采样的开销在测量误差之内。
+RSS优先用psutil读取，没有安装时在Linux上读/proc。
+"""
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+try:
+    import psutil
+except ImportError:  # 没有psutil时只在Linux上读/proc
+    psutil = None
+
+MB = 1024 * 1024
+_active = None
+
+
+def _rss():
+    """当前进程的常驻内存(字节)，无法获取时为NaN"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return float('nan')
+
+
+def stage(name, symbol=None):
+    """记录一个阶段，遥测未启用时为空操作"""
+    if _active is None:
+        return nullcontext()
+    return _active.stage(name, symbol)
+
+
+def active():
+    return _active is not None
+
+
+def wrap(fn, name, symbol=None):
+    """返回在stage(name, symbol)中调用fn的函数，用于给第三方库内部的调用计时"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with stage(name, symbol):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class Telemetry:
+    """一次运行的遥测记录器，with块内为激活状态"""
+
+    def __init__(self, sample_interval=0.005, trace_malloc=True):
+        self.sample_interval = sample_interval
+        self.trace_malloc = trace_malloc
+        self.records = []
+        self.samples = Counter()
+        self._stacks = {}
+        self._open = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started_tracing = False
+        # __enter__失败时报告仍可输出
+        self.started = time.time()
+        self.wall = 0.0
+
+    def __enter__(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError("已有激活的遥测记录器")
+        if self.trace_malloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        if self.sample_interval:
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = None
+        self.wall = time.perf_counter() - self._t0
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        if self._started_tracing:
+            tracemalloc.stop()
+
+    def _bump_alloc_peak(self):
+        """把tracemalloc的峰值计入所有未结束的阶段后重置，嵌套阶段各自得到自己区间内的峰值"""
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for rec in self._open:
+            rec['_alloc_peak'] = max(rec['_alloc_peak'], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name, symbol=None):
+        tid = threading.get_ident()
+        label = f'{name}[{symbol}]' if symbol is not None else name
+        with self._lock:
+            stack = self._stacks.setdefault(tid, [])
+            stack.append(label)
+            path = ';'.join(stack)
+            self._bump_alloc_peak()
+            alloc0 = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+            rss0 = _rss()
+            rec = {'path': path, 'stage': name, 'symbol': symbol, '_rss_peak': rss0,
+                   '_alloc_peak': alloc0 or 0}
+            self._open.append(rec)
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+            with self._lock:
+                self._bump_alloc_peak()
+                rss1 = _rss()
+                self._open.remove(rec)
+                stack.pop()
+                peak = max(rec.pop('_rss_peak'), rss1)
+                alloc_peak = rec.pop('_alloc_peak')
+                rec.update({
+                    'wall_s': wall,
+                    'cpu_s': cpu,
+                    'rss_start_mb': rss0 / MB,
+                    'rss_peak_mb': peak / MB,
+                    'rss_delta_mb': (rss1 - rss0) / MB,
+                })
+                if alloc0 is not None:
+                    rec['alloc_delta_mb'] = (tracemalloc.get_traced_memory()[0] - alloc0) / MB
+                    rec['alloc_peak_mb'] = (alloc_peak - alloc0) / MB
+                self.records.append(rec)
+
+    def _sample(self):
+        """采样线程：记录有未结束阶段的线程的调用栈，同时更新这些阶段的RSS峰值"""
+        me = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            frames = sys._current_frames()
+            rss = _rss()
+            with self._lock:
+                for rec in self._open:
+                    rec['_rss_peak'] = max(rec['_rss_peak'], rss)
+                for tid, stack in self._stacks.items():
+                    frame = frames.get(tid)
+                    if tid == me or not stack or frame is None:
+                        continue
+                    calls = []
+                    while frame is not None:
+                        calls.append(_frame_label(frame))
+                        frame = frame.f_back
+                    self.samples[';'.join(stack + calls[::-1])] += 1
+
+    def summary(self):
+        """按阶段名汇总(同名阶段的各个标的相加，峰值取最大)，嵌套在同名阶段内的记录不重复计入"""
+        out = {}
+        for rec in self.records:
+            if rec['stage'] in (label.split('[')[0] for label in rec['path'].split(';')[:-1]):
+                continue
+            s = out.setdefault(rec['stage'], {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                              'rss_peak_mb': 0.0, 'alloc_delta_mb': 0.0})
+            s['calls'] += 1
+            s['wall_s'] += rec['wall_s']
+            s['cpu_s'] += rec['cpu_s']
+            s['rss_peak_mb'] = max(s['rss_peak_mb'], rec['rss_peak_mb'])
+            s['alloc_delta_mb'] += rec.get('alloc_delta_mb', 0.0)
+        return out
+
+    def write(self, path):
+        """写入{path}.json和{path}.folded，返回两个文件名"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        report = {
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+            'wall_s': self.wall,
+            'sample_interval': self.sample_interval,
+            'trace_malloc': self.trace_malloc,
+            'summary': self.summary(),
+            'stages': self.records,
+        }
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+        with open(path + '.folded', 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f'{stack} {count}\n')
+        return path + '.json', path + '.folded'
+
+    def print_report(self):
+        print(f"{'阶段':16s} {'次数':>4s} {'墙钟(s)':>9s} {'CPU(s)':>9s} {'RSS峰值(MB)':>12s} {'分配净增(MB)':>13s}")
+        for name, s in sorted(self.summary().items(), key=lambda kv: -kv[1]['wall_s']):
+            alloc = f"{s['alloc_delta_mb']:13.1f}" if self.trace_malloc else f"{'-':>13s}"
+            print(f"{name:16s} {s['calls']:4d} {s['wall_s']:9.2f} {s['cpu_s']:9.2f} "
+                  f"{s['rss_peak_mb']:12.1f} {alloc}")
+        print(f"总耗时 {self.wall:.2f}s" + ("  (开启了tracemalloc，耗时偏高)" if self.trace_malloc else ""))
+
+
+def instrument(name):
+    """给入口函数增加telemetry_path和telemetry_malloc参数，
+    传入telemetry_path时整个调用在遥测下运行，结束(包括出错)时写出报告"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, telemetry_path=None, telemetry_malloc=False, **kwargs):
+            if not telemetry_path:
+                return fn(*args, **kwargs)
+            recorder = Telemetry(trace_malloc=telemetry_malloc)
+            try:
+                with recorder, recorder.stage(name):
+                    return fn(*args, **kwargs)
+            finally:
+                recorder.print_report()
+                json_file, folded_file = recorder.write(telemetry_path)
+                print(f"遥测报告: {json_file}  调用栈采样: {folded_file}")
+        return wrapper
+    return decorator
@@ -3,6 +3,8 @@ import talib as ta
 import akshare as ak
 import pandas as pd
 from datetime import datetime
+from performance import EquityRecorder
+from plotting import plot_backtest
 #ds写的策略
 def get_stock_data(code, start_date, end_date):
     """获取股票分钟级数据"""
@@ -147,6 +149,7 @@ if __name__ == '__main__':
         
         # 添加策略
         cerebro.addstrategy(MultiIndicatorStrategy)
+        cerebro.addanalyzer(EquityRecorder, _name='equity')
         
         # 设置初始资金
         cerebro.broker.setcash(1000000.0)
@@ -157,12 +160,12 @@ if __name__ == '__main__':
         print(f'初始资金: {cerebro.broker.getvalue():.2f}')
         
         # 运行回测
-        cerebro.run()
+        strat = cerebro.run()[0]
         
         # 打印最终资金
         print(f'最终资金: {cerebro.broker.getvalue():.2f}')
         
-        # 绘制结果
-        cerebro.plot()
+        # 绘制结果(降采样后写入图片)
+        plot_backtest(strat, 'backtest.png')
     else:
         print("未能获取有效数据，请检查股票代码和日期范围")
\ No newline at end of file
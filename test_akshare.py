@@ -1,24 +1,20 @@
 import akshare as ak
 import pandas as pd
-import backtrader as bt
 import asyncio
 import aiohttp
 from datetime import datetime
+from array_feed import ArrayData
 
 
 # 自定义AKShare数据加载类
-class AKShareData(bt.feeds.PandasData):
-    params = (
-        ('datetime', None),  # 使用默认索引
-        ('open', 'open'),
-        ('high', 'high'),
-        ('low', 'low'),
-        ('close', 'close'),
-        ('volume', 'volume'),
-        ('openinterest', -1),  # 无持仓量字段
-    )
+class AKShareData(ArrayData):
+    """按时间索引和open/high/low/close/volume列整列装载，无持仓量字段"""
 
 import concurrent.futures
+import http_pool
+from ingest import parse_minutes
+from trade_calendar import fetch_range
+import rules
 
 def get_realtime_spot():
     try:
@@ -32,10 +28,12 @@ def get_realtime_spot():
 
         selected_etfs = []
         total_etfs = len(etf_list)
+        # 按交易日历请求刚好够指标预热的交易日
+        start_date, end_date = fetch_range()
         
         def process_etf(symbol):
-            # 获取过去五天的历史数据
-            df_hist = ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date="20250211", end_date="20250214", adjust="qfq")
+            # 获取最近的历史数据
+            df_hist = ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start_date, end_date=end_date, adjust="qfq")
             print(f"{symbol} 历史数据行数：", len(df_hist))
             
             if df_hist.empty or len(df_hist) < 5:
@@ -43,21 +41,19 @@ def get_realtime_spot():
                 return None
             
             # 计算技术指标
-            df_hist['MA5'] = df_hist['收盘'].rolling(window=5).mean()
-            df_hist['MA10'] = df_hist['收盘'].rolling(window=10).mean()
-            df_hist['CCI'] = (df_hist['收盘'] - df_hist['收盘'].rolling(window=14).mean()) / (0.015 * df_hist['收盘'].rolling(window=14).std())
-            df_hist['BB_mid'] = df_hist['收盘'].rolling(window=20).mean()
-            df_hist['Volume_MA5'] = df_hist['成交量'].rolling(window=5).mean()
+            frame = rules.indicator_frame(df_hist['最高'].values, df_hist['最低'].values, df_hist['收盘'].values, df_hist['成交量'].values)
+            df_hist['MA5'] = frame['ma5']
+            df_hist['MA10'] = frame['ma10']
+            df_hist['CCI'] = frame['cci']
+            df_hist['BB_mid'] = frame['bb_mid']
+            df_hist['Volume_MA5'] = frame['vol_ma5']
 
              # 打印技术指标和最后几行数据，帮助调试
             print(f"{symbol} 最新技术指标：")
             print(df_hist[['收盘', 'MA5', 'MA10', 'CCI', 'BB_mid', 'Volume_MA5']].tail(6))
             
             # 筛选满足条件的ETF
-            if (df_hist['MA5'].iloc[-1] > df_hist['MA10'].iloc[-1] and df_hist['MA5'].iloc[-2] <= df_hist['MA10'].iloc[-2] and
-                df_hist['CCI'].iloc[-1] > -100 and
-                df_hist['收盘'].iloc[-1] > df_hist['BB_mid'].iloc[-1] and
-                df_hist['成交量'].iloc[-1] > df_hist['Volume_MA5'].iloc[-1] * 1.1):
+            if rules.SCREEN.evaluate(frame, volume_ratio=1.1)[-1]:
                 print(f"{symbol} 满足条件！")
                 return symbol
             else:
@@ -93,9 +89,9 @@ def get_intraday_minutes(symbol="sh600000"):
     try:
         # 获取当日分时数据（1分钟频度）
         df = ak.stock_zh_a_minute(symbol=symbol, period='1', adjust="")
-        # 格式化时间戳
-        df['day'] = pd.to_numeric(df['day'], errors='coerce')  # 确保 'day' 列为数值类型
-        df['time'] = df['day'].apply(lambda x: datetime.fromtimestamp(x / 1000).strftime('%H:%M') if pd.notna(x) else '')
+        # 时间列整列解析，不再逐行转换
+        df = parse_minutes(df)
+        df['time'] = df.index.strftime('%H:%M')
         
         # 打印关键列
         print(f"股票 {symbol} 当日分时数据：\n", df[['time', 'open', 'high', 'low', 'close', 'volume']])
@@ -103,5 +99,8 @@ def get_intraday_minutes(symbol="sh600000"):
         print("获取分时数据失败:", e)
 
 if __name__ == '__main__':
+    # akshare的请求走共享长连接池
+    http_pool.install()
     get_realtime_spot()
+    http_pool.print_stats()
     #get_intraday_minutes(symbol="sh600000")  # 示例代码为浦发
\ No newline at end of file
@@ -2,21 +2,16 @@ import akshare as ak
 import pandas as pd
 import asyncio
 import aiohttp
-import backtrader as bt
 from datetime import datetime
+from array_feed import ArrayData
+import http_pool
+from trade_calendar import fetch_range
+import rules
 
 
 # 自定义AKShare数据加载类
-class AKShareData(bt.feeds.PandasData):
-    params = (
-        ('datetime', None),  # 使用默认索引
-        ('open', 'open'),
-        ('high', 'high'),
-        ('low', 'low'),
-        ('close', 'close'),
-        ('volume', 'volume'),
-        ('openinterest', -1),  # 无持仓量字段
-    )
+class AKShareData(ArrayData):
+    """按时间索引和open/high/low/close/volume列整列装载，无持仓量字段"""
 
 
 async def fetch_etf_history(session, symbol, start_date, end_date):
@@ -38,30 +33,27 @@ async def fetch_etf_history(session, symbol, start_date, end_date):
 
 async def process_etf(session, symbol):
     """ 处理单个ETF的数据 """
-    # 获取过去五天的历史数据
-    df_hist = await fetch_etf_history(session, symbol, "20240211", "20240214")
+    # 按交易日历请求刚好够指标预热的交易日
+    df_hist = await fetch_etf_history(session, symbol, *fetch_range())
     
     if df_hist is None or df_hist.empty or len(df_hist) < 5:
         print(f"{symbol} 数据为空或长度不足")
         return None
 
     # 计算技术指标
-    df_hist['MA5'] = df_hist['收盘'].rolling(window=5).mean()
-    df_hist['MA10'] = df_hist['收盘'].rolling(window=10).mean()
-    df_hist['CCI'] = (df_hist['收盘'] - df_hist['收盘'].rolling(window=14).mean()) / (0.015 * df_hist['收盘'].rolling(window=14).std())
-    df_hist['BB_mid'] = df_hist['收盘'].rolling(window=20).mean()
-    df_hist['Volume_MA5'] = df_hist['成交量'].rolling(window=5).mean()
+    frame = rules.indicator_frame(df_hist['最高'].values, df_hist['最低'].values, df_hist['收盘'].values, df_hist['成交量'].values)
+    df_hist['MA5'] = frame['ma5']
+    df_hist['MA10'] = frame['ma10']
+    df_hist['CCI'] = frame['cci']
+    df_hist['BB_mid'] = frame['bb_mid']
+    df_hist['Volume_MA5'] = frame['vol_ma5']
 
     # 打印技术指标和最后几行数据，帮助调试
     print(f"{symbol} 最新技术指标：")
     print(df_hist[['收盘', 'MA5', 'MA10', 'CCI', 'BB_mid', 'Volume_MA5']].tail(6))
 
     # 筛选满足条件的ETF
-    if (df_hist['MA5'].iloc[-1] > df_hist['MA10'].iloc[-1] and 
-    #df_hist['MA5'].iloc[-2] <= df_hist['MA10'].iloc[-2] and
-        df_hist['CCI'].iloc[-1] > -100 and
-        df_hist['收盘'].iloc[-1] > df_hist['BB_mid'].iloc[-1] and
-        df_hist['成交量'].iloc[-1] > df_hist['Volume_MA5'].iloc[-1] * 1.1):
+    if rules.SCREEN_TREND.evaluate(frame, volume_ratio=1.1)[-1]:
         print(f"{symbol} 满足条件！")
         return symbol
     else:
@@ -100,7 +92,9 @@ async def get_realtime_spot():
 
 async def main():
     """ 主函数，启动异步任务 """
+    http_pool.install()
     await get_realtime_spot()
+    http_pool.print_stats()
 
 
 if __name__ == '__main__':
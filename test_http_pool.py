@@ -0,0 +1,69 @@
+"""http_pool的连接复用和gzip测试，用本地桩服务器，不需要网络
+
+运行: python -m pytest test_http_pool.py 或 python -m unittest test_http_pool
+"""
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import http_pool
+
+
+class HttpPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http_pool._stub_server()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/hist'
+
+    def tearDown(self):
+        http_pool.uninstall()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_sequential_requests_reuse_one_connection(self):
+        http_pool.install()
+        for i in range(20):
+            r = requests.get(self.url, params={'symbol': f'{i:06d}'}, timeout=10)
+            self.assertEqual(len(r.json()['data']), 500)
+        s = http_pool.stats()
+        self.assertEqual(s['requests'], 20)
+        self.assertEqual(s['connections'], 1)
+        self.assertAlmostEqual(s['reuse_rate'], 0.95)
+        self.assertEqual(s['errors'], 0)
+
+    def test_concurrent_requests_bounded_by_pool_size(self):
+        workers = 4
+        http_pool.install(pool_maxsize=workers)
+
+        def fetch(i):
+            return len(requests.get(self.url, params={'symbol': f'{i:06d}'}, timeout=10).json()['data'])
+
+        with ThreadPoolExecutor(workers * 2) as executor:
+            rows = sum(executor.map(fetch, range(200)))
+        self.assertEqual(rows, 200 * 500)
+        s = http_pool.stats()
+        self.assertEqual(s['requests'], 200)
+        self.assertLessEqual(s['connections'], workers)
+        self.assertGreater(s['reuse_rate'], 0.9)
+
+    def test_responses_are_gzip_compressed(self):
+        http_pool.install()
+        r = requests.get(self.url, timeout=10)
+        self.assertEqual(r.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(r.json()['data']), 500)
+        self.assertEqual(http_pool.stats()['compressed'], 1)
+
+    def test_uninstall_restores_requests(self):
+        http_pool.install()
+        requests.get(self.url, timeout=10)
+        http_pool.uninstall()
+        self.assertIs(requests.api.request, http_pool._original_request)
+        requests.get(self.url, timeout=10)
+        s = http_pool.stats()
+        self.assertEqual(s['requests'], 0)
+        self.assertEqual(s['connections'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
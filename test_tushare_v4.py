@@ -3,23 +3,21 @@ import tushare as ts
 import pandas as pd
 import asyncio
 import aiohttp
-import backtrader as bt
 from datetime import datetime
+from array_feed import ArrayData
+import http_pool
+from trade_calendar import fetch_range
+import rules
 
 # 设置 TuShare token
 ts.set_token('b121a034844abc8d8ee5aa0686a1a3944ac3e3c0e1ef04d8317ab06f')  # 替换为你自己的 API token
 pro = ts.pro_api()
 
 # 自定义TuShare数据加载类
-class TuShareData(bt.feeds.PandasData):
+class TuShareData(ArrayData):
+    """按时间索引整列装载，成交量取vol列，无持仓量字段"""
     params = (
-        ('datetime', None),  # 使用默认索引
-        ('open', 'open'),
-        ('high', 'high'),
-        ('low', 'low'),
-        ('close', 'close'),
-        ('volume', 'vol'),
-        ('openinterest', -1),  # 无持仓量字段
+        ('columns', {'volume': 'vol'}),
     )
 
 
@@ -38,6 +36,8 @@ async def fetch_etf_history(session, symbol, start_date, end_date):
                                 'low': 'low', 'close': 'close', 'vol': 'volume'}, inplace=True)
         df_hist['datetime'] = pd.to_datetime(df_hist['datetime'], format='%Y%m%d')
         df_hist.set_index('datetime', inplace=True)
+        # pro.daily按日期倒序返回，指标计算需要升序
+        df_hist.sort_index(inplace=True)
         
         print(f"{symbol} 历史数据行数：", len(df_hist))
         await asyncio.sleep(60)
@@ -49,29 +49,27 @@ async def fetch_etf_history(session, symbol, start_date, end_date):
 
 async def process_etf(session, symbol):
     """ 处理单个ETF的数据 """
-    # 获取历史数据
-    df_hist = await fetch_etf_history(session, symbol, "20240211", "20240214")
+    # 按交易日历请求刚好够指标预热的交易日
+    df_hist = await fetch_etf_history(session, symbol, *fetch_range())
     
     if df_hist is None or df_hist.empty or len(df_hist) < 5:
         print(f"{symbol} 数据为空或长度不足")
         return None
 
     # 计算技术指标
-    df_hist['MA5'] = df_hist['close'].rolling(window=5).mean()
-    df_hist['MA10'] = df_hist['close'].rolling(window=10).mean()
-    df_hist['CCI'] = (df_hist['close'] - df_hist['close'].rolling(window=14).mean()) / (0.015 * df_hist['close'].rolling(window=14).std())
-    df_hist['BB_mid'] = df_hist['close'].rolling(window=20).mean()
-    df_hist['Volume_MA5'] = df_hist['volume'].rolling(window=5).mean()
+    frame = rules.indicator_frame(df_hist['high'].values, df_hist['low'].values, df_hist['close'].values, df_hist['volume'].values)
+    df_hist['MA5'] = frame['ma5']
+    df_hist['MA10'] = frame['ma10']
+    df_hist['CCI'] = frame['cci']
+    df_hist['BB_mid'] = frame['bb_mid']
+    df_hist['Volume_MA5'] = frame['vol_ma5']
 
     # 打印技术指标和最后几行数据，帮助调试
     print(f"{symbol} 最新技术指标：")
     print(df_hist[['close', 'MA5', 'MA10', 'CCI', 'BB_mid', 'Volume_MA5']].tail(6))
 
     # 筛选满足条件的ETF
-    if (df_hist['MA5'].iloc[-1] > df_hist['MA10'].iloc[-1] and df_hist['MA5'].iloc[-2] <= df_hist['MA10'].iloc[-2] and
-        df_hist['CCI'].iloc[-1] > -100 and
-        df_hist['close'].iloc[-1] > df_hist['BB_mid'].iloc[-1] and
-        df_hist['volume'].iloc[-1] > df_hist['Volume_MA5'].iloc[-1] * 1.1):
+    if rules.SCREEN.evaluate(frame, volume_ratio=1.1)[-1]:
         print(f"{symbol} 满足条件！")
         return symbol
     else:
@@ -110,7 +108,9 @@ async def get_realtime_spot():
 
 async def main():
     """ 主函数，启动异步任务 """
+    http_pool.install()
     await get_realtime_spot()
+    http_pool.print_stats()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+import os
+from datetime import date
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+CACHE_PATH = os.path.join('data', 'trade_calendar.csv')
+
+# 指标预热需要的交易日数：MA10/CCI14/BB20取最长周期，再多1根用于判断上穿/下穿
+WARMUP_BARS = max(10, 14, 20) + 1
+
+
+def _to_day(d):
+    """把'20250214'、'2025-02-14'、date/datetime统一转换为numpy日期"""
+    if d is None:
+        d = date.today()
+    return np.datetime64(pd.Timestamp(d).date(), 'D')
+
+
+def load_trade_dates(cache_path=CACHE_PATH):
+    """读取A股交易日历，本地缓存过期(不含今天)时从新浪重新下载"""
+    today = np.datetime64(date.today(), 'D')
+    if os.path.exists(cache_path):
+        dates = pd.read_csv(cache_path)['trade_date'].to_numpy(dtype='datetime64[D]')
+        if len(dates) and dates[-1] >= today:
+            return dates
+    import akshare as ak
+    df = ak.tool_trade_date_hist_sina()
+    dates = np.sort(pd.to_datetime(df['trade_date']).to_numpy(dtype='datetime64[D]'))
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    pd.DataFrame({'trade_date': dates}).to_csv(cache_path, index=False)
+    return dates
+
+
+class TradingCalendar:
+    """交易日索引
+
+    预先为日历范围内的每个自然日算好"不晚于该日的最后一个交易日"的位置，
+    查询某天往前N个交易日只需一次数组下标访问，是O(1)的。
+    """
+
+    def __init__(self, dates):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.first = self.dates[0]
+        self.last = self.dates[-1]
+        days = self.first + np.arange((self.last - self.first).astype(int) + 1)
+        self._pos = np.searchsorted(self.dates, days, side='right') - 1
+        self._is_session = np.zeros(len(days), dtype=bool)
+        self._is_session[(self.dates - self.first).astype(int)] = True
+
+    def _offset(self, d):
+        offset = (_to_day(d) - self.first).astype(int)
+        if offset < 0 or offset >= len(self._pos):
+            raise ValueError(f"{d} 超出交易日历范围 {self.first} ~ {self.last}")
+        return offset
+
+    def is_trading_day(self, d=None):
+        return bool(self._is_session[self._offset(d)])
+
+    def last_session(self, d=None):
+        """不晚于d的最近一个交易日"""
+        i = self._pos[self._offset(d)]
+        return self.dates[i] if i >= 0 else None
+
+    def sessions_back(self, n, end=None):
+        """截至end(含)的最近n个交易日的首尾日期"""
+        i = self._pos[self._offset(end)]
+        if i < 0:
+            return None
+        return self.dates[max(0, i - n + 1)], self.dates[i]
+
+    def count_sessions(self, start, end):
+        """[start, end]区间内的交易日数"""
+        i = self._pos[self._offset(end)]
+        j = self._pos[self._offset(start)]
+        return int(i - j + self._is_session[self._offset(start)])
+
+    def plan_fetch(self, start, end):
+        """把请求区间收缩到区间内的首尾交易日，区间内没有交易日时返回None"""
+        if self.count_sessions(start, end) == 0:
+            return None
+        i = self._pos[self._offset(end)]
+        j = i - self.count_sessions(start, end) + 1
+        return self.dates[j], self.dates[i]
+
+
+@lru_cache(maxsize=1)
+def get_calendar():
+    return TradingCalendar(load_trade_dates())
+
+
+def fetch_range(n=WARMUP_BARS, end=None, fmt='%Y%m%d'):
+    """返回刚好覆盖最近n个交易日的请求区间(字符串)，供行情接口的start_date/end_date使用"""
+    cal = get_calendar()
+    sessions = cal.sessions_back(n, end)
+    if sessions is None:
+        raise ValueError(f"{end}及之前没有交易日(交易日历从{cal.first}开始)")
+    start, stop = sessions
+    return pd.Timestamp(start).strftime(fmt), pd.Timestamp(stop).strftime(fmt)
+
+
+if __name__ == '__main__':
+    cal = get_calendar()
+    print(f"交易日历: {cal.first} ~ {cal.last}，共 {len(cal.dates)} 个交易日")
+    print("最近21个交易日:", fetch_range())
+    print("20240211-20240214 (春节):", cal.plan_fetch('20240211', '20240214'))
+    print("截至20250214的最近5个交易日:", fetch_range(5, '20250214'))